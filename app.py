@@ -5,43 +5,104 @@
 Flask server for PDF → MCQs → Google Form pipeline
 """
 
-from flask import Flask, request, jsonify, send_from_directory, session, redirect, url_for, render_template_string, g
+from flask import Flask, Request, request, jsonify, send_from_directory, session, redirect, url_for, make_response
+import asyncio
+import atexit
+import functools
 import os
+import re
+import shutil
 import tempfile
 import logging
-import json
-import traceback
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import timedelta
+from typing import Callable
 from dotenv import load_dotenv, find_dotenv
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import RequestEntityTooLarge
+import orjson
+import base64
 import io
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import hmac
 import hashlib
-from urllib.parse import urlparse
-
-# Optional: Twilio (for WhatsApp via Twilio)
-try:
-    from twilio.request_validator import RequestValidator
-    from twilio.rest import Client as TwilioClient
-except Exception:
-    RequestValidator = None
-    TwilioClient = None
+from urllib.parse import unquote, urlparse
 
 # For Google Drive API sharing
+import httplib2
+from google.auth.transport.requests import Request as GoogleAuthRequest
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 
 # Import our existing pipeline components
-from pdf_to_questions import generate_mcqs_to_file
+from pdf_to_questions import extract_text_from_pdf, generate_mcqs_to_file_async, log_event
 from create_form_from_json import create_form_from_json
-from token_utils import save_env_to_json
+from token_utils import save_env_to_json, read_google_token
+from cache_utils import bytes_digest, file_digest, mcq_cache_key, mcq_text_cache_key, get_cached_mcqs, put_cached_mcqs, redis_client
 
 load_dotenv('/secrets/.env')
 
+class _OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson (used by jsonify and request.get_json)."""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+
+class _InMemoryUploadRequest(Request):
+    """Keep multipart file parts in memory instead of a SpooledTemporaryFile.
+
+    Uploads are read straight into bytes for the pipeline, so spilling them to a
+    temp file first only doubles the I/O. MAX_CONTENT_LENGTH bounds the size.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return io.BytesIO()
+
+
 app = Flask(__name__)
+app.json = _OrjsonProvider(app)
+app.request_class = _InMemoryUploadRequest
 
 # Set secret key for sessions
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'dev-secret')
 
+# Signed-cookie sessions that expire on their own; the cookie is only re-issued
+# at login rather than re-signed and re-sent on every request
+app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=int(os.getenv('SESSION_LIFETIME_HOURS', '12')))
+app.config['SESSION_REFRESH_EACH_REQUEST'] = False
+
+# Unhandled exceptions become a logged JSON 500 even if FLASK_DEBUG is set (never the debugger page)
+app.config['PROPAGATE_EXCEPTIONS'] = False
+
+# Reject oversized uploads with 413 before the body is read or parsed
+app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_UPLOAD_MB', '50')) * 1024 * 1024
+
+# Behind nginx/Apache with X-Sendfile support, let the proxy stream files from disk
+# (send_from_directory then sends only a header). Off by default: Cloud Run has no such proxy.
+app.config['USE_X_SENDFILE'] = (os.getenv('USE_X_SENDFILE') or '').strip().lower() in ('1', 'true', 'yes')
+
+# Where bundled assets live (BG.webp next to this file, /web/ files one level up)
+_ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+_WEB_DIR = os.path.join(os.path.dirname(_ROOT_DIR), 'web')
+
+# Deployment settings, resolved once (after /secrets/.env is loaded)
+FORMS_AUTH_METHOD = os.getenv('FORMS_AUTH_METHOD', 'oauth')
+SA_FILE = os.getenv('SA_FILE')  # None → create_form_from_json / Drive fall back to client_secret.json
+TOKEN_PATH = os.getenv('TOKEN_PATH') or '/secrets/token.pkl'
+_TOKEN_EXISTS = os.path.exists(TOKEN_PATH)
+_DEBUG_BREADCRUMBS = bool(os.getenv('DEBUG_BREADCRUMBS'))
+
 # Import new validation functions
 from pdf_to_questions import normalize_language, clamp_num_questions, resolve_token_path
 
@@ -70,7 +131,7 @@ LOGIN_TEMPLATE = '''
             margin: 100px auto;
             padding: 20px;
             line-height: 1.6;
-            background: url('/BG.webp') no-repeat center center fixed;
+            background: url('/BG.webp?v={{ bg_version }}') no-repeat center center fixed;
             background-size: cover;
         }
         h1 {
@@ -147,7 +208,7 @@ FORM_TEMPLATE = '''
             margin: 0 auto;
             padding: 20px;
             line-height: 1.6;
-            background: url('/BG.webp') no-repeat center center fixed;
+            background: url('/BG.webp?v={{ bg_version }}') no-repeat center center fixed;
             background-size: cover;
         }
         .overlay {
@@ -332,6 +393,26 @@ FORM_TEMPLATE = '''
         const status = document.getElementById('status');
         const submitBtn = document.getElementById('submitBtn');
 
+        const STAGE_LABELS = {
+            GENERATING_MCQS: 'Generating questions from the PDF…',
+            CREATING_FORM: 'Creating the Google Form…'
+        };
+
+        // Poll a pipeline job every 2s until it succeeds or fails
+        async function pollJob(jobId) {
+            while (true) {
+                await new Promise(resolve => setTimeout(resolve, 2000));
+                const res = await fetch('/api/pipeline/' + encodeURIComponent(jobId));
+                const data = await res.json();
+                if (!res.ok || data.status === 'SUCCESS' || data.status === 'FAILURE') {
+                    return data;
+                }
+                if (STAGE_LABELS[data.stage]) {
+                    status.textContent = STAGE_LABELS[data.stage];
+                }
+            }
+        }
+
         form.addEventListener('submit', async (e) => {
             e.preventDefault();
             
@@ -341,33 +422,40 @@ FORM_TEMPLATE = '''
             status.textContent = 'Working… Please wait, this may take a few minutes.';
             status.className = 'loading';
             
-            const fd = new FormData();
             const pdf = document.getElementById('pdf').files[0];
             const count = document.getElementById('count').value;
             const lang = document.getElementById('lang').value;
             const shareWith = (document.getElementById('share_with').value || '').trim();
-            
-            fd.append('pdf', pdf);
-            fd.append('num_questions', count);
-            fd.append('language', lang);
-            fd.append('share_with', shareWith);
+
+            // Send the PDF as the raw body (no multipart); parameters go in the query string
+            const params = new URLSearchParams({
+                num_questions: count,
+                language: lang,
+                share_with: shareWith
+            });
 
             try {
-                const res = await fetch('/api/pipeline', { 
-                    method: 'POST', 
-                    body: fd 
+                const res = await fetch('/api/pipeline_stream?' + params.toString(), {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/pdf',
+                        'X-Filename': encodeURIComponent(pdf.name)
+                    },
+                    body: pdf
                 });
-                
-                const data = await res.json();
-                
-                if (data.success) {
-                    status.textContent = JSON.stringify(data, null, 2);
+
+                const job = await res.json();
+                const data = job.success ? await pollJob(job.job_id) : job;
+
+                if (data.success && data.status === 'SUCCESS') {
+                    const result = data.result || {};
+                    status.textContent = JSON.stringify(result, null, 2);
                     status.className = 'success';
-                    
+
                     // Show form URL prominently
-                    if (data.form_edit_url) {
+                    if (result.form_edit_url) {
                         const urlDiv = document.createElement('div');
-                        urlDiv.innerHTML = `<br><strong>🎉 Google Form Created!</strong><br><a href="${data.form_edit_url}" target="_blank">${data.form_edit_url}</a>`;
+                        urlDiv.innerHTML = `<br><strong>🎉 Google Form Created!</strong><br><a href="${result.form_edit_url}" target="_blank">${result.form_edit_url}</a>`;
                         status.appendChild(urlDiv);
                     }
                 } else {
@@ -421,14 +509,47 @@ FORM_TEMPLATE = '''
 </html>
 '''
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)-8s | %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
+# Background image (referenced by every page): read once at import
+try:
+    with open(os.path.join(_ROOT_DIR, 'BG.webp'), 'rb') as _bg:
+        _BG_BYTES = _bg.read()
+    _BG_ETAG = hashlib.md5(_BG_BYTES).hexdigest()
+except OSError:
+    _BG_BYTES = None
+    _BG_ETAG = None
+
+# Compile the page templates once at import (same Flask Jinja env and autoescaping
+# as render_template_string, without re-parsing the source on every request)
+_LOGIN_T = app.jinja_env.from_string(LOGIN_TEMPLATE)
+_FORM_T = app.jinja_env.from_string(FORM_TEMPLATE)
+# Pages link BG.webp with its content hash, so the browser may cache it for good
+_BG_VERSION = (_BG_ETAG or '')[:12]
+# The form page only varies with that hash, so render it once
+_FORM_HTML = _FORM_T.render(bg_version=_BG_VERSION)
+_FORM_ETAG = hashlib.md5(_FORM_HTML.encode('utf-8')).hexdigest()
+# The login page only ever shows no error or the one fixed error message
+_LOGIN_HTML = _LOGIN_T.render(bg_version=_BG_VERSION)
+_LOGIN_FAILED_HTML = _LOGIN_T.render(bg_version=_BG_VERSION, error="Invalid password")
+
+# Set up logging (once: leave an already-configured root logger alone, e.g. on re-import)
+if not logging.getLogger().handlers:
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s | %(levelname)-8s | %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S"
+    )
+# Chatty third-party loggers on the pipeline path
+logging.getLogger("pdfminer").setLevel(logging.WARNING)
+logging.getLogger("googleapiclient.discovery_cache").setLevel(logging.ERROR)
 logger = logging.getLogger(__name__)
 
+# Service account mode: materialize the key from the CLIENT_SECRET env var once at startup
+if FORMS_AUTH_METHOD == 'sa':
+    try:
+        save_env_to_json('CLIENT_SECRET', 'client_secret.json')
+    except Exception as e:
+        logger.error(f"Could not write client_secret.json from CLIENT_SECRET: {e}")
+
 # Authentication helpers
 def is_logged_in():
     """Check if user is logged in"""
@@ -447,37 +568,62 @@ def require_auth(f):
 # WhatsApp Bot Helpers
 # -----------------------------
 
-def _parse_allowlist() -> set:
+@functools.lru_cache(maxsize=1)
+def _parse_allowlist() -> frozenset:
+    # Parsed once: the environment does not change while the process runs
     raw = (os.getenv('WHATSAPP_ALLOWLIST') or '').strip()
     if not raw:
-        return set()
-    # Accept formats like: "+972501234567,+972..." or "whatsapp:+972..."
-    parts = [p.strip() for p in raw.split(',') if p.strip()]
-    return set(parts)
+        return frozenset()
+    # Accept formats like: "+972501234567,+972..." or "whatsapp:+972..."; store the bare number
+    parts = (p.strip() for p in raw.split(','))
+    return frozenset(p[9:] if p.startswith('whatsapp:') else p for p in parts if p)
 
 
 def _is_allowed_sender(sender: str) -> bool:
-    allow = _parse_allowlist()
-    if not allow:
-        # If no allowlist is configured, default-deny for safety
-        return False
-    if sender in allow:
-        return True
+    # An empty allowlist denies everyone (default-deny for safety)
     # Normalize Twilio WhatsApp sender format: "whatsapp:+972..."
-    if sender.startswith('whatsapp:'):
-        s2 = sender.replace('whatsapp:', '', 1)
-        return s2 in allow
-    return False
+    return (sender[9:] if sender.startswith('whatsapp:') else sender) in _parse_allowlist()
+
+
+# One pooled session for media downloads: Twilio's media host (and the storage it
+# redirects to) keep their TLS connections alive between webhooks
+_HTTP_SESSION = requests.Session()
+_HTTP_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504)),
+))
+
+
+def _looks_like_pdf(head: bytes) -> bool:
+    """PDF magic bytes; readers accept the header anywhere in the first 1 KiB."""
+    return b'%PDF' in head[:1024]
+
 
+class _NotAPdfError(ValueError):
+    pass
 
-def _download_to_tmp(url: str, dst_path: str, headers: dict | None = None) -> None:
+
+def _download_to_tmp(
+    url: str,
+    dst_path: str,
+    headers: dict | None = None,
+    auth: tuple | None = None,
+    require_pdf: bool = False,
+) -> None:
     headers = headers or {}
-    with requests.get(url, headers=headers, stream=True, timeout=60) as r:
+    with _HTTP_SESSION.get(url, headers=headers, auth=auth, stream=True, timeout=60) as r:
         r.raise_for_status()
+        # Copy the raw stream in C (decoding any Content-Encoding) instead of
+        # looping over iter_content chunks in Python
+        r.raw.decode_content = True
+        head = r.raw.read(1024)
+        # Stop before pulling the rest of a non-PDF body over the network
+        if require_pdf and not _looks_like_pdf(head):
+            raise _NotAPdfError('Downloaded media is not a PDF')
         with open(dst_path, 'wb') as f:
-            for chunk in r.iter_content(chunk_size=1024 * 1024):
-                if chunk:
-                    f.write(chunk)
+            f.write(head)
+            shutil.copyfileobj(r.raw, f, length=4 * 1024 * 1024)
 
 # -----------------------------
 # WhatsApp Bot Conversation State
@@ -489,8 +635,8 @@ _WA_SESSION_FILE = '/tmp/wa_sessions.json'
 def _wa_load_sessions() -> dict:
     try:
         if os.path.exists(_WA_SESSION_FILE):
-            with open(_WA_SESSION_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f) or {}
+            with open(_WA_SESSION_FILE, 'rb') as f:
+                return orjson.loads(f.read()) or {}
     except Exception:
         pass
     return {}
@@ -509,38 +655,63 @@ def _wa_get(sender: str) -> dict:
     return sessions.get(sender) or {}
 
 
-def _wa_set(sender: str, state: dict) -> None:
-    sessions = _wa_load_sessions()
-    sessions[sender] = state
-    _wa_save_sessions(sessions)
+# Background download/pipeline jobs update sessions too; serialize the read-modify-write
+_WA_LOCK = threading.RLock()
 
 
-def _wa_clear(sender: str) -> None:
-    sessions = _wa_load_sessions()
-    if sender in sessions:
-        sessions.pop(sender, None)
+def _wa_set(sender: str, state: dict) -> None:
+    with _WA_LOCK:
+        sessions = _wa_load_sessions()
+        sessions[sender] = state
         _wa_save_sessions(sessions)
 
 
+def _wa_clear(sender: str, job: str | None = None) -> None:
+    # With job, only clear the session that job was started for: the user may
+    # have reset and begun a new conversation while it ran
+    with _WA_LOCK:
+        sessions = _wa_load_sessions()
+        if sender in sessions and (job is None or sessions[sender].get('job') == job):
+            sessions.pop(sender, None)
+            _wa_save_sessions(sessions)
+
+
+# A background step not finished after this long is treated as lost (e.g. the
+# instance restarted mid-job), so the conversation can start over
+_WA_JOB_TIMEOUTS = {'DOWNLOADING': 5 * 60, 'PROCESSING': 30 * 60}
+
+
+def _wa_job_is_stale(st: dict) -> bool:
+    timeout = _WA_JOB_TIMEOUTS.get(st.get('step'))
+    return timeout is not None and time.time() - (st.get('started_at') or 0) > timeout
+
+
 def _wa_reset(sender: str) -> None:
-    # Start a fresh conversation
-    _wa_set(sender, {
-        'step': 'WAIT_PDF',
-        'pdf_path': None,
-        'tmpdir': None,
-        'num_questions': None,
-        'language': None,
-        'share_with': None,
-    })
+    # Start a fresh conversation, dropping a PDF left over from an abandoned one
+    # (a running pipeline owns its files and removes them itself)
+    with _WA_LOCK:
+        old = _wa_get(sender)
+        if old.get('tmpdir') and (old.get('step') != 'PROCESSING' or _wa_job_is_stale(old)):
+            shutil.rmtree(old['tmpdir'], ignore_errors=True)
+        _wa_set(sender, {
+            'step': 'WAIT_PDF',
+            'pdf_path': None,
+            'tmpdir': None,
+            'num_questions': None,
+            'language': None,
+            'share_with': None,
+        })
+
+
+# Simple practical email validation
+_EMAIL_RE = re.compile(r'^[^\s@]+@[^\s@]+\.[^\s@]+$')
 
 
 def _is_valid_email(email: str) -> bool:
     email = (email or '').strip()
     if not email:
         return False
-    # Simple practical validation
-    import re
-    return re.match(r'^[^\s@]+@[^\s@]+\.[^\s@]+$', email) is not None
+    return _EMAIL_RE.match(email) is not None
 
 
 def _parse_int_only(text: str) -> int | None:
@@ -560,11 +731,111 @@ def _normalize_lang_choice(text: str) -> str | None:
     if not t:
         return None
     # Accept numeric and textual options
-    if t in ('1', 'english', 'en', 'angielski', 'ang', 'אנגלית'):
-        return 'en'
-    if t in ('2', 'hebrew', 'he', 'עברית'):
-        return 'he'
-    return None
+    return _WA_LANG_CHOICES.get(t)
+
+
+# WhatsApp keywords, matched against the lowercased message body
+_WA_RESET_WORDS = frozenset(('cancel', 'reset', 'התחל מחדש', 'ביטול'))
+_WA_SKIP_WORDS = frozenset(('skip', 'דלג', 'לא', 'none'))
+_WA_LANG_CHOICES = {
+    **dict.fromkeys(('1', 'english', 'en', 'angielski', 'ang', 'אנגלית'), 'en'),
+    **dict.fromkeys(('2', 'hebrew', 'he', 'עברית'), 'he'),
+}
+
+
+# Drive file id inside a Google Forms edit URL (.../forms/d/<id>/edit)
+_FORM_ID_RE = re.compile(r'/d/([a-zA-Z0-9_-]+)')
+# A form's response link ("/viewform", possibly with "?usp=..." appended)
+_VIEWFORM_RE = re.compile(r'/viewform(?:\?.*)?$')
+
+
+def _responses_url_for(form_url: str) -> str:
+    """Map a form's response (viewform) link to its responses page in the editor."""
+    responses_url, n = _VIEWFORM_RE.subn('/edit#responses', form_url, count=1)
+    return responses_url if n else form_url + '#responses'
+
+
+# Short blocking Google I/O that overlaps with a pipeline step. Kept separate from
+# the pipeline executor so pipeline jobs never wait on their own pool.
+_IO_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='medtrain-io')
+
+
+_CRED_CACHE: dict = {}
+# Pipeline jobs share the cached credentials: load and refresh them one job at a time
+_CRED_LOCK = threading.Lock()
+
+
+def _load_drive_creds(auth_method: str):
+    """Return Drive credentials, re-reading them from disk only once the cached ones expire."""
+    creds = _CRED_CACHE.get(auth_method)
+    if creds is not None and creds.valid:
+        return creds
+    with _CRED_LOCK:
+        return _load_drive_creds_locked(auth_method)
+
+
+def _load_drive_creds_locked(auth_method: str):
+    creds = _CRED_CACHE.get(auth_method)
+    if creds is None or creds.expired:
+        if auth_method == 'sa':
+            creds = service_account.Credentials.from_service_account_file(
+                SA_FILE or 'client_secret.json',
+                scopes=[
+                    'https://www.googleapis.com/auth/drive',
+                    'https://www.googleapis.com/auth/forms.body',
+                    'https://www.googleapis.com/auth/forms.responses.readonly',
+                ],
+            )
+        else:
+            creds = read_google_token(TOKEN_PATH)
+        _CRED_CACHE[auth_method] = creds
+    if not creds.valid:
+        creds.refresh(GoogleAuthRequest())
+    return creds
+
+
+@functools.lru_cache(maxsize=1)
+def _drive_discovery_service():
+    """Build the Drive v3 service once, from the discovery document bundled with
+    google-api-python-client (no network fetch).
+
+    It is not bound to credentials: callers pass their own AuthorizedHttp to
+    execute(), since httplib2 is not thread-safe.
+    """
+    return build('drive', 'v3', http=httplib2.Http(), cache_discovery=False, static_discovery=True)
+
+
+def _get_drive_service(auth_method: str):
+    """Return (credentials, Drive service) for the given auth method."""
+    return _load_drive_creds(auth_method), _drive_discovery_service()
+
+
+# httplib2.Http keeps its TLS connections open between requests but is not
+# thread-safe, so each executor thread keeps one and reuses it for every call.
+_HTTP_LOCAL = threading.local()
+
+
+def _thread_http() -> httplib2.Http:
+    http = getattr(_HTTP_LOCAL, 'http', None)
+    if http is None:
+        http = _HTTP_LOCAL.http = httplib2.Http()
+    return http
+
+
+def _share_form(file_id: str, share_with: str, drive_future) -> None:
+    """Grant share_with editor access to the form (runs on _IO_EXECUTOR)."""
+    try:
+        creds, drive_service = drive_future.result()
+        permission = {'type': 'user', 'role': 'writer', 'emailAddress': share_with}
+        drive_service.permissions().create(
+            fileId=file_id,
+            body=permission,
+            sendNotificationEmail=False,
+        ).execute(http=AuthorizedHttp(creds, http=_thread_http()))
+        logger.info(f"Shared form {file_id} with {share_with}")
+    except Exception as e:
+        logger.error(f"Failed to share form {file_id} with {share_with}: {e}")
+        raise
 
 
 def _derive_form_links(form_edit_url: str) -> dict:
@@ -588,87 +859,87 @@ def _run_pipeline_on_pdf_path(
     model: str,
     share_with: str | None,
     tmpdir: str,
+    pdf_bytes: bytes | None = None,
+    on_stage: Callable[[str], None] | None = None,
+    on_share_done: Callable[[Future], None] | None = None,
 ) -> dict:
     """Run the existing pipeline given a PDF on disk.
 
+    When pdf_bytes is given (web uploads), the PDF is read from memory and
+    pdf_path only names it. tmpdir receives mcqs.json. on_stage, if given, is
+    called with the name of each stage as it starts (for job progress).
+    on_share_done, if given, is attached to the background Drive share future.
+
     Returns the same structure you return from /api/pipeline (where possible).
     """
-    FORMS_AUTH_METHOD = os.getenv('FORMS_AUTH_METHOD', 'oauth')
-    if FORMS_AUTH_METHOD == 'sa':
-        # ensure service account json exists if you use that mode
-        save_env_to_json('CLIENT_SECRET', 'client_secret.json')
-
     logger.info(f"Starting pipeline (bot/web): PDF={os.path.basename(pdf_path)}, questions={num_questions}, language={language}")
 
-    # Step 1: PDF → MCQs JSON
-    mcqs_json_path = generate_mcqs_to_file(
-        pdf_path=pdf_path,
-        output_dir=tmpdir,
-        model=model,
-        num_questions=num_questions,
-        language=language,
-    )
-
-    # Safety check / truncation
-    try:
-        with open(mcqs_json_path, 'r', encoding='utf-8') as f:
-            mcqs_data = json.load(f)
-        questions = mcqs_data.get('questions', [])
-        if not questions:
-            raise ValueError('No questions generated from PDF')
-        if len(questions) > num_questions:
-            mcqs_data['questions'] = questions[:num_questions]
-            with open(mcqs_json_path, 'w', encoding='utf-8') as f:
-                json.dump(mcqs_data, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        logger.error(f"Question validation failed: {e}")
+    if on_stage:
+        on_stage('GENERATING_MCQS')
+
+    # Step 1: PDF → MCQs JSON (served from cache when this PDF was already processed with the same settings)
+    pdf_digest = bytes_digest(pdf_bytes) if pdf_bytes is not None else file_digest(pdf_path)
+    cache_key = mcq_cache_key(pdf_digest, num_questions, language, model)
+    cached_mcqs = get_cached_mcqs(cache_key)
+    if cached_mcqs is None:
+        # Extract once here so the text is cache-keyed too (a re-exported PDF with
+        # the same text still hits), and hand the text to the generator.
+        pdf_text = extract_text_from_pdf(pdf_path, pdf_bytes)
+        text_cache_key = mcq_text_cache_key(pdf_text, num_questions, language, model)
+        cached_mcqs = get_cached_mcqs(text_cache_key)
+        if cached_mcqs is not None:
+            put_cached_mcqs(cache_key, cached_mcqs)
+
+    if cached_mcqs is not None:
+        logger.info("MCQ cache hit; skipping generation")
+        mcqs_json_path = os.path.join(tmpdir, 'mcqs.json')
+        with open(mcqs_json_path, 'wb') as f:
+            f.write(cached_mcqs)
+        mcqs_data = orjson.loads(cached_mcqs)
+    else:
+        # (runs on a job/webhook thread, so it gets its own event loop; the
+        # generator enforces the question cap and raises if none were produced)
+        mcqs_json_path, mcqs_data, complete = asyncio.run(generate_mcqs_to_file_async(
+            pdf_path=pdf_path,
+            output_dir=tmpdir,
+            model=model,
+            num_questions=num_questions,
+            language=language,
+            pdf_bytes=pdf_bytes,
+            text=pdf_text,
+        ))
+        # A short quiz (a chunk failed or came back short) is used once, not cached
+        if complete:
+            mcqs_blob = orjson.dumps(mcqs_data)
+            put_cached_mcqs(cache_key, mcqs_blob)
+            put_cached_mcqs(text_cache_key, mcqs_blob)
+
+    # Load Drive credentials/service while the form is being created (independent Google calls)
+    drive_future = _IO_EXECUTOR.submit(_get_drive_service, FORMS_AUTH_METHOD) if share_with else None
 
     # Step 2: JSON → Google Form
+    if on_stage:
+        on_stage('CREATING_FORM')
     form_edit_url = create_form_from_json(
         json_path=mcqs_json_path,
         auth_method=FORMS_AUTH_METHOD,
-        sa_file=os.getenv('SA_FILE'),
+        sa_file=SA_FILE,
         share_with=share_with if share_with else None,
+        data=mcqs_data,
     )
 
-    # Step 3: (optional) share via Drive permissions (same logic as /api/pipeline)
+    # Step 3: (optional) share via Drive permissions. Nobody waits on this, so it
+    # runs in the background and the result reports it as pending.
     share_success = None
     drive_share_error = None
     if form_edit_url and share_with:
-        import re
-        m = re.search(r'/d/([a-zA-Z0-9_-]+)', form_edit_url)
+        m = _FORM_ID_RE.search(form_edit_url)
         file_id = m.group(1) if m else None
         if file_id:
-            try:
-                creds = None
-                if FORMS_AUTH_METHOD == 'sa':
-                    from google.oauth2 import service_account
-                    sa_file = os.getenv('SA_FILE') or 'client_secret.json'
-                    creds = service_account.Credentials.from_service_account_file(
-                        sa_file,
-                        scopes=[
-                            'https://www.googleapis.com/auth/drive',
-                            'https://www.googleapis.com/auth/forms.body',
-                            'https://www.googleapis.com/auth/forms.responses.readonly',
-                        ],
-                    )
-                else:
-                    import pickle
-                    token_path = os.getenv('TOKEN_PATH') or '/secrets/token.pkl'
-                    with open(token_path, 'rb') as token:
-                        creds = pickle.load(token)
-
-                drive_service = build('drive', 'v3', credentials=creds)
-                permission = {'type': 'user', 'role': 'writer', 'emailAddress': share_with}
-                drive_service.permissions().create(
-                    fileId=file_id,
-                    body=permission,
-                    sendNotificationEmail=False,
-                ).execute()
-                share_success = True
-            except Exception as e:
-                share_success = False
-                drive_share_error = str(e)
+            share_future = _IO_EXECUTOR.submit(_share_form, file_id, share_with, drive_future)
+            if on_share_done:
+                share_future.add_done_callback(on_share_done)
+            share_success = 'pending'
 
     return {
         'success': True,
@@ -684,45 +955,232 @@ def _run_pipeline_on_pdf_path(
     }
 
 
-def _twilio_send_message(to_number: str, body: str) -> None:
-    """Send a WhatsApp message via Twilio."""
-    if TwilioClient is None:
+# -----------------------------
+# Background pipeline jobs
+# -----------------------------
+
+# The pipeline takes minutes (OpenAI + Google Forms), so /api/pipeline only
+# enqueues it and the browser polls /api/pipeline/<job_id> for the outcome.
+# Job state lives in-process and, when REDIS_URL is set, also in Redis, since a
+# poll may be routed to a different Cloud Run instance than the one running the job.
+# Concurrent pipelines per instance (PIPELINE_WORKERS). Threads, not processes: the
+# work is mostly waiting on OpenAI/Google, and the CPU-heavy PDF extraction already
+# fans out to worker processes (see pdf_to_questions).
+_PIPELINE_EXECUTOR = ThreadPoolExecutor(
+    max_workers=max(1, int(os.getenv('PIPELINE_WORKERS', '4'))),
+    thread_name_prefix='medtrain-pipeline',
+)
+_JOBS: dict = {}
+_JOBS_LOCK = threading.Lock()
+# Finished jobs stay pollable for this long, then are dropped so _JOBS doesn't grow forever
+_JOB_TTL = int(os.getenv('JOB_TTL_SECONDS', '3600'))
+# Redis hash per job (field -> orjson value), expiring _JOB_TTL after its last update
+_JOB_REDIS_PREFIX = 'medtrain:job:'
+
+# Scratch space for pipeline jobs: one root per worker process, removed on exit,
+# with a subdirectory per job that the job removes when it finishes.
+_WORKER_TMP = tempfile.mkdtemp(prefix='medtrain_worker_', dir='/tmp')
+atexit.register(shutil.rmtree, _WORKER_TMP, ignore_errors=True)
+
+
+def _set_job(job_id: str, **fields) -> None:
+    with _JOBS_LOCK:
+        _JOBS.setdefault(job_id, {}).update(fields)
+    client = redis_client()
+    if client is not None:
+        key = _JOB_REDIS_PREFIX + job_id
+        try:
+            pipe = client.pipeline()
+            pipe.hset(key, mapping={k: orjson.dumps(v) for k, v in fields.items()})
+            pipe.expire(key, _JOB_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Redis job write failed for {job_id}; only this instance can report it: {e}")
+
+
+def _prune_jobs() -> None:
+    """Drop jobs that finished more than _JOB_TTL seconds ago."""
+    cutoff = time.monotonic() - _JOB_TTL
+    with _JOBS_LOCK:
+        expired = [jid for jid, job in _JOBS.items() if job.get('finished_at', cutoff) < cutoff]
+        for jid in expired:
+            del _JOBS[jid]
+
+
+def _get_job(job_id: str) -> dict | None:
+    with _JOBS_LOCK:
+        job = _JOBS.get(job_id)
+        if job is not None:
+            return dict(job)
+    # Not ours: the job may be running on another instance
+    client = redis_client()
+    if client is None:
+        return None
+    try:
+        fields = client.hgetall(_JOB_REDIS_PREFIX + job_id)
+    except Exception as e:
+        logger.warning(f"Redis job read failed for {job_id}: {e}")
+        return None
+    return {k.decode('utf-8'): orjson.loads(v) for k, v in fields.items()} or None
+
+
+def _record_share_result(job_id: str, fut: Future) -> None:
+    """Store the outcome of a job's background Drive share (may land after SUCCESS)."""
+    error = fut.exception()
+    _set_job(job_id, share_success=error is None, drive_share_error=str(error) if error else None)
+
+
+def _run_pipeline_job(job_id: str, pdf_path: str, *, tmpdir: str, **kwargs) -> None:
+    """Executor entry point: run the pipeline and record the outcome for polling."""
+    _set_job(job_id, status='STARTED')
+    try:
+        result = _run_pipeline_on_pdf_path(
+            pdf_path,
+            tmpdir=tmpdir,
+            on_stage=lambda stage: _set_job(job_id, stage=stage),
+            on_share_done=lambda fut: _record_share_result(job_id, fut),
+            **kwargs,
+        )
+        _set_job(job_id, status='SUCCESS', result=result, finished_at=time.monotonic())
+        logger.info(f"Pipeline job {job_id} completed successfully")
+    except Exception as e:
+        logger.error(f"Pipeline job {job_id} failed: {e}")
+        _set_job(job_id, status='FAILURE', error=f"Pipeline failed: {str(e)}", finished_at=time.monotonic())
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def _enqueue_pipeline(
+    pdf_filename: str,
+    pdf_bytes: bytes,
+    *,
+    num_questions: int,
+    language: str,
+    model: str,
+    share_with: str,
+) -> str:
+    """Submit an uploaded PDF (held in memory) to the pipeline executor; returns the job id."""
+    # The job id is also the only handle on the job's results, so it stays unguessable (uuid4)
+    job_id = uuid.uuid4().hex
+
+    # Debug breadcrumbs (opt-in: DEBUG_BREADCRUMBS=1 or debug mode)
+    if _DEBUG_BREADCRUMBS or app.debug:
+        log_event(
+            "pipeline.inputs",
+            job_id=job_id,
+            language=language,
+            num_questions=num_questions,
+            model=model,
+            token_exists=_TOKEN_EXISTS,
+            key_present=bool(os.getenv("OPENAI_API_KEY")),
+        )
+
+    logger.info(f"Starting pipeline: PDF={pdf_filename}, questions={num_questions}, language={language}")
+
+    if not share_with:
+        share_with = (os.getenv('SHARE_WITH') or '').strip()
+
+    # The extractors read the PDF bytes directly, so the upload never touches
+    # disk; tmpdir only receives mcqs.json.
+    _prune_jobs()
+    tmpdir = os.path.join(_WORKER_TMP, job_id)
+    os.mkdir(tmpdir)
+    _set_job(job_id, status='PENDING')
+    _PIPELINE_EXECUTOR.submit(
+        _run_pipeline_job,
+        job_id,
+        pdf_filename,
+        pdf_bytes=pdf_bytes,
+        num_questions=num_questions,
+        language=language,
+        model=model,
+        share_with=share_with if share_with else None,
+        tmpdir=tmpdir,
+    )
+    logger.info(f"Pipeline job {job_id} enqueued")
+    return job_id
+
+
+@functools.lru_cache(maxsize=1)
+def _twilio_client():
+    """Return a Twilio REST client. The SDK is optional and heavy, so it is imported on first send."""
+    try:
+        from twilio.rest import Client as TwilioClient
+    except ImportError:
         raise RuntimeError('Twilio SDK not installed. pip install twilio')
     sid = os.getenv('TWILIO_ACCOUNT_SID')
     token = os.getenv('TWILIO_AUTH_TOKEN')
+    if not (sid and token):
+        raise RuntimeError('Missing TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN env vars')
+    return TwilioClient(sid, token)
+
+
+def _twilio_send_message(to_number: str, body: str) -> None:
+    """Send a WhatsApp message via Twilio."""
     from_number = os.getenv('TWILIO_WHATSAPP_FROM')  # e.g. "whatsapp:+14155238886" or your approved number
-    if not (sid and token and from_number):
-        raise RuntimeError('Missing TWILIO_ACCOUNT_SID / TWILIO_AUTH_TOKEN / TWILIO_WHATSAPP_FROM env vars')
-    client = TwilioClient(sid, token)
-    client.messages.create(from_=from_number, to=to_number, body=body)
+    if not from_number:
+        raise RuntimeError('Missing TWILIO_WHATSAPP_FROM env var')
+    _twilio_client().messages.create(from_=from_number, to=to_number, body=body)
+
+
+# Webhook replies go out on their own threads so Twilio gets its 200 without
+# waiting on the REST round trip. The pipeline job sends its results inline.
+_TWILIO_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='medtrain-twilio')
+
+
+def _log_twilio_send_error(fut: Future) -> None:
+    error = fut.exception()
+    if error is not None:
+        logger.error(f"Twilio send failed: {error}")
+
+
+def _twilio_reply(to_number: str, body: str) -> None:
+    """Queue a WhatsApp message for sending; failures are logged, not raised."""
+    _TWILIO_EXECUTOR.submit(_twilio_send_message, to_number, body).add_done_callback(_log_twilio_send_error)
+
+
+# Twilio signs webhooks with HMAC-SHA1 keyed on the account auth token
+_TWILIO_TOKEN_BYTES = (os.getenv('TWILIO_AUTH_TOKEN') or '').encode('utf-8')
 
 
 def _twilio_validate_request(req) -> bool:
     """Validate Twilio webhook signature (recommended for production)."""
-    if RequestValidator is None:
-        # If SDK missing, do not silently accept in production.
+    if not _TWILIO_TOKEN_BYTES:
+        # Without the auth token nothing can be verified; do not silently accept.
         return False
-    auth_token = os.getenv('TWILIO_AUTH_TOKEN') or ''
     signature = req.headers.get('X-Twilio-Signature', '')
+    if not signature:
+        return False
     # Build the full URL Twilio used (Cloud Run behind proxy may need X-Forwarded-Proto)
     proto = req.headers.get('X-Forwarded-Proto', req.scheme)
     host = req.headers.get('X-Forwarded-Host', req.host)
-    url = f"{proto}://{host}{req.path}"
-    validator = RequestValidator(auth_token)
-    return validator.validate(url, req.form.to_dict(flat=True), signature)
+    # Signed payload: the URL followed by each POST parameter name and value, sorted by name
+    parts = [f"{proto}://{host}{req.path}"]
+    for key in sorted(req.form.keys()):
+        for value in sorted(req.form.getlist(key)):
+            parts.append(key)
+            parts.append(value)
+    mac = hmac.new(_TWILIO_TOKEN_BYTES, ''.join(parts).encode('utf-8'), hashlib.sha1).digest()
+    return hmac.compare_digest(base64.b64encode(mac).decode('ascii'), signature)
 
 # Atomic JSON writer for current form link persistence. We do NOT use env vars
 # for this because environment variables are read-only at runtime on many
 # platforms (e.g., Cloud Run). We persist the active link in a JSON file.
+# fsync only buys durability on a real disk. /tmp on Cloud Run is in-memory and
+# dies with the container, so skip it there (ATOMIC_FSYNC=0 skips it everywhere).
+_ATOMIC_FSYNC = (os.getenv('ATOMIC_FSYNC') or '1').strip().lower() not in ('0', 'false', 'no')
+
+
 def _atomic_write_json(target_path: str, data: dict):
     directory = os.path.dirname(target_path)
     os.makedirs(directory, exist_ok=True)
     fd, tmp_path = tempfile.mkstemp(prefix=".tmp_current_form_", dir=directory)
     try:
-        with os.fdopen(fd, 'w', encoding='utf-8') as tmpf:
-            json.dump(data, tmpf, ensure_ascii=False, indent=2)
+        with os.fdopen(fd, 'wb') as tmpf:
+            tmpf.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
             tmpf.flush()
-            os.fsync(tmpf.fileno())
+            if _ATOMIC_FSYNC and not target_path.startswith('/tmp/'):
+                os.fsync(tmpf.fileno())
         os.replace(tmp_path, target_path)
     except Exception:
         try:
@@ -752,8 +1210,74 @@ def _resolve_current_form_json_path() -> str:
     except Exception:
         pass
     # Fallback to project directory for local dev
-    project_dir = os.path.dirname(os.path.abspath(__file__))
-    return os.path.join(project_dir, 'current_form.json')
+    return os.path.join(_ROOT_DIR, 'current_form.json')
+
+# The writable location cannot change while the process runs
+CURRENT_FORM_JSON_PATH = _resolve_current_form_json_path()
+
+# Parsed current_form.json, keyed on the file's mtime (writers replace the file atomically)
+_CURRENT_FORM_CACHE = (None, {})
+
+# With REDIS_URL set the pointer lives in a Redis hash shared by all instances.
+# Reads are cached in-process for a few seconds so redirect bursts cost one round trip.
+_CURRENT_FORM_REDIS_KEY = 'medtrain:current_form'
+_CURRENT_FORM_FIELDS = ('active_form_url', 'active_responses_url')
+_CURRENT_FORM_REDIS_TTL = 5.0  # seconds
+_CURRENT_FORM_REDIS_CACHE = (0.0, None)
+
+
+def _read_current_form_file() -> dict:
+    global _CURRENT_FORM_CACHE
+    try:
+        mtime_ns = os.stat(CURRENT_FORM_JSON_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    cached_mtime, cached_data = _CURRENT_FORM_CACHE
+    if mtime_ns == cached_mtime:
+        return cached_data
+    with open(CURRENT_FORM_JSON_PATH, 'rb') as f:
+        data = orjson.loads(f.read()) or {}
+    _CURRENT_FORM_CACHE = (mtime_ns, data)
+    return data
+
+
+def _read_current_form() -> dict:
+    """Return the current form links ({} if not set), from Redis when configured, else current_form.json."""
+    global _CURRENT_FORM_REDIS_CACHE
+    client = redis_client()
+    if client is None:
+        return _read_current_form_file()
+    fetched_at, cached_data = _CURRENT_FORM_REDIS_CACHE
+    if cached_data is not None and time.monotonic() - fetched_at < _CURRENT_FORM_REDIS_TTL:
+        return cached_data
+    try:
+        values = client.hmget(_CURRENT_FORM_REDIS_KEY, *_CURRENT_FORM_FIELDS)
+    except Exception as e:
+        logger.warning(f"Redis current form read failed, using {CURRENT_FORM_JSON_PATH}: {e}")
+        return _read_current_form_file()
+    data = {k: v.decode('utf-8') for k, v in zip(_CURRENT_FORM_FIELDS, values) if v is not None}
+    _CURRENT_FORM_REDIS_CACHE = (time.monotonic(), data)
+    return data
+
+
+def _write_current_form(form_url: str, responses_url: str) -> None:
+    """Point /current-form and /current-responses at a new quiz."""
+    global _CURRENT_FORM_REDIS_CACHE, _CURRENT_FORM_CACHE
+    data = {'active_form_url': form_url, 'active_responses_url': responses_url}
+    client = redis_client()
+    if client is not None:
+        try:
+            client.hset(_CURRENT_FORM_REDIS_KEY, mapping=data)
+            _CURRENT_FORM_REDIS_CACHE = (time.monotonic(), data)
+            return
+        except Exception as e:
+            logger.warning(f"Redis current form write failed, using {CURRENT_FORM_JSON_PATH}: {e}")
+    _atomic_write_json(CURRENT_FORM_JSON_PATH, data)
+    # Write-through, so this process's next redirect doesn't re-read what it just wrote
+    try:
+        _CURRENT_FORM_CACHE = (os.stat(CURRENT_FORM_JSON_PATH).st_mtime_ns, data)
+    except OSError:
+        pass
 
 # Authentication routes
 @app.route('/login', methods=['GET', 'POST'])
@@ -764,14 +1288,15 @@ def login():
         correct_password = os.getenv('PIPELINE_PASSWORD', 'changeme')
         
         if password == correct_password:
+            session.permanent = True
             session['logged_in'] = True
             logger.info("User logged in successfully")
             return redirect('/form')
         else:
             logger.warning("Invalid login attempt")
-            return render_template_string(LOGIN_TEMPLATE, error="Invalid password")
+            return _LOGIN_FAILED_HTML
     
-    return render_template_string(LOGIN_TEMPLATE)
+    return _LOGIN_HTML
 
 @app.route('/logout')
 def logout():
@@ -785,15 +1310,16 @@ def form():
     """Main form page - requires authentication"""
     if not is_logged_in():
         return redirect(url_for('login'))
-    return render_template_string(FORM_TEMPLATE)
+    # Static page: let the browser revalidate with If-None-Match and get a 304
+    resp = make_response(_FORM_HTML)
+    resp.set_etag(_FORM_ETAG)
+    resp.headers['Cache-Control'] = 'private, max-age=0, must-revalidate'
+    return resp.make_conditional(request)
 
 @app.route('/api/pipeline', methods=['POST'])
 @require_auth
 def pipeline():
     """Handle PDF → MCQs Google Form Generator pipeline"""
-    FORMS_AUTH_METHOD = os.getenv('FORMS_AUTH_METHOD', 'oauth')
-    if FORMS_AUTH_METHOD == 'sa':
-        save_env_to_json('CLIENT_SECRET', 'client_secret.json')
     try:
         # Validate required fields
         if 'pdf' not in request.files:
@@ -811,61 +1337,78 @@ def pipeline():
         num_questions = _get_num_questions()
         model = request.form.get('model', 'gpt-4.1').strip()
 
-        # Debug breadcrumbs
-        print(json.dumps({
-            "evt": "pipeline.inputs",
-            "req_id": getattr(g, "req_id", None),
-            "language": language,
-            "num_questions": num_questions,
-            "model": model,
-            "token_exists": os.path.exists("/secrets/token.pkl"),
-            "key_present": bool(os.getenv("OPENAI_API_KEY")),
-        }), flush=True)
-
-        logger.info(f"Starting pipeline: PDF={pdf_filename}, questions={num_questions}, language={language}")
+        share_with = (request.form.get('share_with') or '').strip()
 
-        # Create temporary directory for processing (use /tmp for Cloud Run)
-        tmpdir = tempfile.mkdtemp(prefix="medtrain_", dir="/tmp")
-        pdf_path = os.path.join(tmpdir, pdf_filename)
+        pdf_bytes = f.read()
+        if not _looks_like_pdf(pdf_bytes):
+            return jsonify({"success": False, "error": "File is not a PDF"}), 400
 
         try:
-            # Save uploaded PDF
-            f.save(pdf_path)
-            logger.info(f"PDF saved to: {pdf_path}")
-
-            # Run core pipeline
-            share_with = (request.form.get('share_with') or '').strip()
-            if not share_with:
-                share_with = (os.getenv('SHARE_WITH') or '').strip()
-
-            result = _run_pipeline_on_pdf_path(
-                pdf_path,
+            job_id = _enqueue_pipeline(
+                pdf_filename,
+                pdf_bytes,
                 num_questions=num_questions,
                 language=language,
                 model=model,
-                share_with=share_with if share_with else None,
-                tmpdir=tmpdir,
+                share_with=share_with,
             )
+        except Exception as e:
+            logger.error(f"Pipeline error: {str(e)}")
+            return jsonify({
+                "success": False,
+                "error": f"Pipeline failed: {str(e)}"
+            }), 500
+        return jsonify({"success": True, "job_id": job_id, "status": "PENDING"}), 202
+
+    except RequestEntityTooLarge:
+        raise  # answered as JSON by request_too_large
+    except Exception as e:
+        logger.error(f"Server error: {str(e)}")
+        return jsonify({
+            "success": False,
+            "error": f"Server error: {str(e)}"
+        }), 500
 
-            logger.info("Pipeline completed successfully")
-            return jsonify(result)
+@app.route('/api/pipeline_stream', methods=['POST'])
+@require_auth
+def pipeline_stream():
+    """Same as /api/pipeline, but the PDF is the raw request body (no multipart parsing).
 
+    Parameters come from the query string; the (URL-encoded) file name from X-Filename.
+    """
+    try:
+        # Read the body before anything touches request.form
+        pdf_bytes = b''.join(iter(lambda: request.stream.read(1024 * 1024), b''))
+        if not pdf_bytes:
+            return jsonify({"success": False, "error": "Empty request body"}), 400
+        if not _looks_like_pdf(pdf_bytes):
+            return jsonify({"success": False, "error": "File is not a PDF"}), 400
+
+        pdf_filename = unquote(request.headers.get('X-Filename') or '').strip() or 'upload.pdf'
+        language = _get_language()
+        num_questions = _get_num_questions()
+        model = (request.args.get('model') or 'gpt-4.1').strip()
+        share_with = (request.args.get('share_with') or '').strip()
+
+        try:
+            job_id = _enqueue_pipeline(
+                pdf_filename,
+                pdf_bytes,
+                num_questions=num_questions,
+                language=language,
+                model=model,
+                share_with=share_with,
+            )
         except Exception as e:
             logger.error(f"Pipeline error: {str(e)}")
             return jsonify({
                 "success": False,
                 "error": f"Pipeline failed: {str(e)}"
             }), 500
+        return jsonify({"success": True, "job_id": job_id, "status": "PENDING"}), 202
 
-        finally:
-            # Clean up temporary files (optional - you might want to keep them for debugging)
-            try:
-                if os.path.exists(pdf_path):
-                    os.remove(pdf_path)
-                logger.info("Temporary files cleaned up")
-            except Exception as e:
-                logger.warning(f"Failed to clean up temporary files: {e}")
-
+    except RequestEntityTooLarge:
+        raise  # answered as JSON by request_too_large
     except Exception as e:
         logger.error(f"Server error: {str(e)}")
         return jsonify({
@@ -873,11 +1416,46 @@ def pipeline():
             "error": f"Server error: {str(e)}"
         }), 500
 
+@app.errorhandler(500)
+def internal_error(e):
+    """Unhandled exception: Flask has already logged the traceback; answer with JSON, not the HTML error page."""
+    return jsonify({"success": False, "error": "Internal server error"}), 500
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Upload exceeded MAX_CONTENT_LENGTH (MAX_UPLOAD_MB)."""
+    return jsonify({
+        "success": False,
+        "error": f"PDF too large (limit {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB)"
+    }), 413
+
+@app.route('/api/pipeline/<job_id>', methods=['GET'])
+@require_auth
+def pipeline_status(job_id):
+    """Report the state of a pipeline job (PENDING, STARTED, SUCCESS, FAILURE) and its current stage."""
+    job = _get_job(job_id)
+    if job is None:
+        return jsonify({"success": False, "error": "Unknown job id"}), 404
+
+    payload = {"success": True, "job_id": job_id, "status": job.get('status'), "stage": job.get('stage')}
+    if job.get('status') == 'SUCCESS':
+        result = dict(job.get('result') or {})
+        if 'share_success' in job:
+            # The Drive share finishes in the background; report it once known
+            result['share_success'] = job['share_success']
+            result['drive_share_error'] = job['drive_share_error']
+        payload['result'] = result
+    elif job.get('status') == 'FAILURE':
+        payload['success'] = False
+        payload['error'] = job.get('error')
+    return jsonify(payload)
+
 @app.route('/api/set_current_form', methods=['POST'])
 @require_auth
 def set_current_form():
-    """Set the current active Google Form (response link) atomically in JSON.
-    Persists to /secrets/current_form.json under key "active_form_url".
+    """Set the current active Google Form (response link).
+    Persists to Redis when REDIS_URL is set, else atomically to current_form.json.
     """
     try:
         if not request.is_json:
@@ -888,16 +1466,9 @@ def set_current_form():
             return jsonify({"success": False, "error": "form_url is required"}), 400
 
         # Compute responses URL based on the provided form_url
-        if form_url.endswith("/viewform"):
-            responses_url = form_url.replace("/viewform", "/edit#responses")
-        else:
-            responses_url = form_url + "#responses"
+        responses_url = _responses_url_for(form_url)
 
-        target_path = _resolve_current_form_json_path()
-        _atomic_write_json(target_path, {
-            "active_form_url": form_url,
-            "active_responses_url": responses_url
-        })
+        _write_current_form(form_url, responses_url)
         return jsonify({
             "success": True,
             "active_form_url": form_url,
@@ -907,19 +1478,22 @@ def set_current_form():
         logger.error(f"set_current_form error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+def _conditional_redirect(url: str):
+    """Redirect to url, answering 304 when the client's ETag shows it already has this target."""
+    resp = redirect(url)
+    resp.set_etag(hashlib.md5(url.encode('utf-8')).hexdigest())
+    # Revalidate every time: the active form can change at any moment
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp.make_conditional(request)
+
 @app.route('/current-form', methods=['GET'])
 def current_form_redirect():
     """Redirect to the currently active Google Form. 404 if not set."""
     try:
-        target_path = _resolve_current_form_json_path()
-        if not os.path.exists(target_path):
-            return jsonify({"success": False, "error": "No active form set"}), 404
-        with open(target_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        url = (data.get('active_form_url') or '').strip()
+        url = (_read_current_form().get('active_form_url') or '').strip()
         if not url:
             return jsonify({"success": False, "error": "No active form set"}), 404
-        return redirect(url)
+        return _conditional_redirect(url)
     except Exception as e:
         logger.error(f"current_form_redirect error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
@@ -928,34 +1502,33 @@ def current_form_redirect():
 def current_responses_redirect():
     """Redirect to the current active form's responses page."""
     try:
-        target_path = _resolve_current_form_json_path()
-        if not os.path.exists(target_path):
-            return jsonify({"success": False, "error": "No active form set"}), 404
-        with open(target_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        url = (data.get('active_responses_url') or '').strip()
+        url = (_read_current_form().get('active_responses_url') or '').strip()
         if not url:
             return jsonify({"success": False, "error": "No active responses link set"}), 404
-        return redirect(url)
+        return _conditional_redirect(url)
     except Exception as e:
         logger.error(f"current_responses_redirect error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+# Probe responses never change: serialize them once. (No request hooks run for probes.)
+_HEALTH_BODY = orjson.dumps({"status": "healthy", "service": "PDF to Google Form Pipeline"})
+_HEALTHZ_BODY = orjson.dumps({"status": "ok"})
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint"""
-    return jsonify({"status": "healthy", "service": "PDF to Google Form Pipeline"})
+    return app.response_class(_HEALTH_BODY, mimetype='application/json')
 
 @app.route('/healthz', methods=['GET'])
 def healthz():
     """Health check endpoint (Cloud Run standard)"""
-    return {"status": "ok"}
+    return app.response_class(_HEALTHZ_BODY, mimetype='application/json')
 
 @app.route('/web/<path:filename>')
 def web_files(filename):
     """Serve web interface files"""
-    web_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'web')
-    return send_from_directory(web_dir, filename)
+    # ETag/Last-Modified revalidation and Range requests are on; browsers may reuse a copy for an hour
+    return send_from_directory(_WEB_DIR, filename, conditional=True, etag=True, max_age=3600)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -968,18 +1541,149 @@ def index():
 @app.route('/BG.webp')
 def bg_image():
     """Serve the background image from project root."""
-    root_dir = os.path.dirname(os.path.abspath(__file__))
-    return send_from_directory(root_dir, 'BG.webp')
+    if _BG_BYTES is None:
+        return ("Not found", 404)
+    resp = make_response(_BG_BYTES)
+    resp.mimetype = 'image/webp'
+    resp.set_etag(_BG_ETAG)
+    # Pages request it as /BG.webp?v=<hash>, so a new image gets a new URL
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp.make_conditional(request)
+
+# During an outage (OpenAI, Twilio) every job fails the same way: log the full
+# traceback at most once per second per exception type, the message every time.
+_LAST_TRACEBACK_AT: dict = {}
+
+
+def _log_exception_limited(msg: str, exc: BaseException) -> None:
+    """Log msg; include the traceback unless one for this exception type was just logged.
+
+    Call from an except block (logger.exception reads the active exception)."""
+    now = time.monotonic()
+    kind = type(exc)
+    if now - _LAST_TRACEBACK_AT.get(kind, 0.0) < 1.0:
+        logger.error(msg)
+        return
+    _LAST_TRACEBACK_AT[kind] = now
+    logger.exception(msg)
+
+
+def _whatsapp_pipeline_job(sender: str, st: dict, url_root: str) -> None:
+    """Executor entry point for the WhatsApp flow: run the pipeline, message the
+    sender the links, clean up. The webhook returns before this runs, so Twilio's
+    15s webhook timeout never fires (and never triggers a retry)."""
+    pdf_path = st.get('pdf_path')
+    tmpdir = st.get('tmpdir')
+    num_questions = st.get('num_questions') or 6
+    language = st.get('language') or 'en'
+    model = (os.getenv('WHATSAPP_MODEL') or 'gpt-4.1').strip()
+    share_with = st.get('share_with')
+
+    try:
+        if not pdf_path or not tmpdir or not os.path.exists(pdf_path):
+            raise RuntimeError('Missing PDF in session. Please send the PDF again.')
+
+        result = _run_pipeline_on_pdf_path(
+            pdf_path,
+            num_questions=num_questions,
+            language=language,
+            model=model,
+            share_with=share_with,
+            tmpdir=tmpdir,
+        )
+
+        form_edit_url = (result.get('form_edit_url') or '').strip()
+        links = _derive_form_links(form_edit_url)
+
+        # ✅ Update the "current quiz" pointer so /current-form points to the latest quiz response link
+        try:
+            _write_current_form(links['view'], links['responses'])
+        except Exception as e:
+            logger.error(f"Failed to update current form: {e}")
+
+        # ✅ Stable links (constant endpoints on your Cloud Run service)
+        stable_view_link = f"{url_root}/current-form"
+        stable_responses_link = f"{url_root}/current-responses"
+
+        if links['edit']:
+            msg = (
+                "✅ סיימתי! הנה הקישורים:\n"
+                f"1) קישור לעריכה: {links['edit']}\n"
+                f"2) קישור למענה (קבוע): {stable_view_link}\n"
+                f"3) צפייה בתשובות (קבוע): {stable_responses_link}"
+            )
+            _twilio_send_message(sender, msg)
+        else:
+            _twilio_send_message(sender, "❌ יצירת הטופס נכשלה (לא התקבל קישור). בדוק לוגים.")
+
+    except Exception as e:
+        _log_exception_limited(f"WhatsApp Twilio pipeline error: {e}", e)
+        try:
+            _twilio_send_message(sender, f"❌ נכשל: {e}")
+        except Exception:
+            pass
+
+    finally:
+        # Cleanup: the PDF, mcqs.json and the directory itself
+        if tmpdir:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+        _wa_clear(sender, job=st.get('job'))
+
+
+def _whatsapp_download_job(sender: str, media_url: str, job: str) -> None:
+    """Fetch the sender's PDF from Twilio, then ask for the number of questions (runs on _IO_EXECUTOR)."""
+    tmpdir = tempfile.mkdtemp(prefix='medtrain_wa_', dir='/tmp')
+    pdf_path = os.path.join(tmpdir, 'input.pdf')
+    try:
+        sid = os.getenv('TWILIO_ACCOUNT_SID')
+        token = os.getenv('TWILIO_AUTH_TOKEN')
+        if not (sid and token):
+            raise RuntimeError('Missing TWILIO_ACCOUNT_SID/TWILIO_AUTH_TOKEN for media download')
+        _download_to_tmp(media_url, pdf_path, auth=(sid, token), require_pdf=True)
+    except Exception as e:
+        if isinstance(e, _NotAPdfError):
+            logger.warning(f"WhatsApp media from {sender} is not a PDF")
+            reply = "נראה שלא שלחת PDF תקין. תוכל לשלוח שוב בבקשה קובץ PDF?"
+        else:
+            _log_exception_limited(f"WhatsApp download error: {e}", e)
+            reply = "הייתה בעיה להוריד את הקובץ. נסה שוב בבקשה."
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        with _WA_LOCK:
+            st = _wa_get(sender)
+            if st.get('step') == 'DOWNLOADING' and st.get('job') == job:
+                st['step'] = 'WAIT_PDF'
+                _wa_set(sender, st)
+        _twilio_reply(sender, reply)
+        return
+
+    # Save state, unless the user reset the conversation while we were downloading
+    with _WA_LOCK:
+        st = _wa_get(sender)
+        if st.get('step') != 'DOWNLOADING' or st.get('job') != job:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return
+        st['step'] = 'WAIT_Q'
+        st['pdf_path'] = pdf_path
+        st['tmpdir'] = tmpdir
+        _wa_set(sender, st)
+
+    _twilio_reply(sender, "תודה! ✅ קיבלתי את ה-PDF.\nכמה שאלות תרצה ליצור? (ענה במספר בלבד)")
+
+
+def _whatsapp_set_form_job(sender: str, link: str, responses_url: str, url_root: str) -> None:
+    """Admin 'set <link>': update the current form pointer, then confirm (runs on _IO_EXECUTOR)."""
+    try:
+        _write_current_form(link, responses_url)
+    except Exception as e:
+        logger.error(f"Failed to update current form: {e}")
+        _twilio_reply(sender, f"❌ Failed to update: {e}")
+        return
+    _twilio_reply(sender, f"✅ Current quiz link updated. Responses: {url_root}/current-responses")
+
+
+_WA_MAX_BODY = 64 * 1024
+_WA_MAX_BODY_CHARS = 1024
 
-if __name__ == "__main__":
-    # Get port from environment variable (Cloud Run) or default to 5050 for local dev
-    port = int(os.getenv('PORT', 5050))
-    host = os.getenv('HOST', '127.0.0.1')
-    
-    logger.info("Starting Flask server...")
-    logger.info(f"Open http://{host}:{port} in your browser")
-    logger.info("Login with password: changeme (or set PIPELINE_PASSWORD in .env)")
-    app.run(host=host, port=port, debug=True)
 
 @app.route('/whatsapp/twilio', methods=['POST'])
 def whatsapp_twilio_inbound():
@@ -994,231 +1698,159 @@ def whatsapp_twilio_inbound():
 
     Notes:
       - Requires WHATSAPP_ALLOWLIST to contain the sender number.
-      - Validates X-Twilio-Signature when Twilio SDK is available.
+      - Validates X-Twilio-Signature (requires TWILIO_AUTH_TOKEN); bodies over 64 KiB are rejected.
       - This state store is best-effort; for strong reliability use Firestore/Redis.
     """
-    # Signature validation (recommended). If SDK missing, reject.
+    # Twilio posts small url-encoded forms (media arrives by URL). Reject anything
+    # bigger from the headers alone, before the body is parsed.
+    if (request.content_length or 0) > _WA_MAX_BODY:
+        return ("too large", 413)
+    # Signature validation: the header is checked before request.form is parsed
     if not _twilio_validate_request(request):
         return ("invalid signature", 403)
 
     sender = (request.form.get('From') or '').strip()  # e.g. "whatsapp:+972..."
     body = (request.form.get('Body') or '').strip()
-    num_media = int(request.form.get('NumMedia') or '0')
+    try:
+        num_media = int(request.form.get('NumMedia') or '0')
+    except ValueError:
+        num_media = 0
 
     # Authorization
     if not _is_allowed_sender(sender):
-        try:
-            _twilio_send_message(sender, "מצטער, המספר הזה לא מורשה להשתמש בבוט.")
-        except Exception:
-            pass
+        _twilio_reply(sender, "מצטער, המספר הזה לא מורשה להשתמש בבוט.")
         return ("forbidden", 403)
 
+    # Every valid answer (a number, a language, an email, a link) is short
+    if len(body) > _WA_MAX_BODY_CHARS:
+        _twilio_reply(sender, "ההודעה ארוכה מדי. אנא ענה בקצרה 🙂")
+        return ("ok", 200)
+
     # Global commands
-    if body.strip().lower() in ('cancel', 'reset', 'התחל מחדש', 'ביטול'):
+    if body.lower() in _WA_RESET_WORDS:
         _wa_reset(sender)
-        _twilio_send_message(sender, "התחלנו מחדש ✅\nשלח לי בבקשה את קובץ ה-PDF.")
+        _twilio_reply(sender, "התחלנו מחדש ✅\nשלח לי בבקשה את קובץ ה-PDF.")
         return ("ok", 200)
 
-    # Admin command: set current form link (kept as-is)
+    # Admin command: set current form link
     if body.lower().startswith('set '):
         link = body[4:].strip()
         if not link:
-            _twilio_send_message(sender, "Please send: set <Google Form response link>")
+            _twilio_reply(sender, "Please send: set <Google Form response link>")
             return ("ok", 200)
-        try:
-            if link.endswith('/viewform'):
-                responses_url = link.replace('/viewform', '/edit#responses')
-            else:
-                responses_url = link + '#responses'
-            target_path = _resolve_current_form_json_path()
-            _atomic_write_json(target_path, {
-                'active_form_url': link,
-                'active_responses_url': responses_url,
-            })
-            _twilio_send_message(sender, f"✅ Current quiz link updated. Responses: {request.url_root.rstrip('/')}/current-responses")
-        except Exception as e:
-            _twilio_send_message(sender, f"❌ Failed to update: {e}")
+        responses_url = _responses_url_for(link)
+        # Write (Redis or fsync'd file) and confirm in the background
+        _IO_EXECUTOR.submit(_whatsapp_set_form_job, sender, link, responses_url, request.url_root.rstrip('/'))
         return ("ok", 200)
 
     # Load or initialize session
     st = _wa_get(sender)
     if not st or not st.get('step'):
         _wa_reset(sender)
-        _twilio_send_message(sender, "היי! 👋\nשלח לי בבקשה את קובץ ה-PDF של הדף/המסמך שממנו תרצה לייצר שאלון.")
+        _twilio_reply(sender, "היי! 👋\nשלח לי בבקשה את קובץ ה-PDF של הדף/המסמך שממנו תרצה לייצר שאלון.")
         return ("ok", 200)
 
     step = st.get('step')
 
+    # Its background job was lost: fall through to the reset below
+    if _wa_job_is_stale(st):
+        logger.warning(f"WhatsApp {step} session for {sender} timed out; starting over")
+        step = None
+
     # Step 1: wait for PDF
     if step == 'WAIT_PDF':
         if num_media < 1:
-            _twilio_send_message(sender, "שלח לי בבקשה קובץ PDF כדי שאוכל להתחיל 🙂")
+            _twilio_reply(sender, "שלח לי בבקשה קובץ PDF כדי שאוכל להתחיל 🙂")
+            return ("ok", 200)
+        if num_media > 1:
+            _twilio_reply(sender, "אנא שלח קובץ PDF אחד בכל פעם.")
             return ("ok", 200)
 
         media_url = (request.form.get('MediaUrl0') or '').strip()
         media_type = (request.form.get('MediaContentType0') or '').strip()
 
         if 'pdf' not in media_type.lower() and not media_url.lower().endswith('.pdf'):
-            _twilio_send_message(sender, "נראה שלא שלחת PDF תקין. תוכל לשלוח שוב בבקשה קובץ PDF?")
+            _twilio_reply(sender, "נראה שלא שלחת PDF תקין. תוכל לשלוח שוב בבקשה קובץ PDF?")
             return ("ok", 200)
 
-        # Download PDF
-        tmpdir = tempfile.mkdtemp(prefix='medtrain_wa_', dir='/tmp')
-        pdf_path = os.path.join(tmpdir, 'input.pdf')
-        try:
-            sid = os.getenv('TWILIO_ACCOUNT_SID')
-            token = os.getenv('TWILIO_AUTH_TOKEN')
-            if not (sid and token):
-                raise RuntimeError('Missing TWILIO_ACCOUNT_SID/TWILIO_AUTH_TOKEN for media download')
-            with requests.get(media_url, auth=(sid, token), stream=True, timeout=60) as r:
-                r.raise_for_status()
-                with open(pdf_path, 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=1024 * 1024):
-                        if chunk:
-                            f.write(chunk)
-        except Exception as e:
-            logger.error(f"WhatsApp download error: {e}")
-            logger.error(traceback.format_exc())
-            _twilio_send_message(sender, "הייתה בעיה להוריד את הקובץ. נסה שוב בבקשה.")
-            try:
-                if os.path.exists(pdf_path):
-                    os.remove(pdf_path)
-            except Exception:
-                pass
-            return ("ok", 200)
-
-        # Save state
-        st['step'] = 'WAIT_Q'
-        st['pdf_path'] = pdf_path
-        st['tmpdir'] = tmpdir
+        # Download in the background so Twilio gets its 200 right away
+        st['step'] = 'DOWNLOADING'
+        st['job'] = uuid.uuid4().hex
+        st['started_at'] = time.time()
         _wa_set(sender, st)
+        _IO_EXECUTOR.submit(_whatsapp_download_job, sender, media_url, st['job'])
+        return ("ok", 200)
 
-        _twilio_send_message(sender, "תודה! ✅ קיבלתי את ה-PDF.\nכמה שאלות תרצה ליצור? (ענה במספר בלבד)")
+    # PDF still downloading
+    if step == 'DOWNLOADING':
+        _twilio_reply(sender, "אני עדיין מוריד את הקובץ ⏳ רגע אחד…")
         return ("ok", 200)
 
     # Step 2: number of questions
     if step == 'WAIT_Q':
         n = _parse_int_only(body)
         if n is None:
-            _twilio_send_message(sender, "אנא ענה במספר בלבד (לדוגמה: 8).")
+            _twilio_reply(sender, "אנא ענה במספר בלבד (לדוגמה: 8).")
             return ("ok", 200)
         n = clamp_num_questions(str(n), default=6)
         st['num_questions'] = n
         st['step'] = 'WAIT_LANG'
         _wa_set(sender, st)
-        _twilio_send_message(sender, "באיזו שפה תרצה שהשאלות יהיו?\nענה 1 לאנגלית או 2 לעברית.")
+        _twilio_reply(sender, "באיזו שפה תרצה שהשאלות יהיו?\nענה 1 לאנגלית או 2 לעברית.")
         return ("ok", 200)
 
     # Step 3: language
     if step == 'WAIT_LANG':
         lang = _normalize_lang_choice(body)
         if not lang:
-            _twilio_send_message(sender, "לא הצלחתי להבין. אנא ענה 1 (אנגלית) או 2 (עברית).")
+            _twilio_reply(sender, "לא הצלחתי להבין. אנא ענה 1 (אנגלית) או 2 (עברית).")
             return ("ok", 200)
         st['language'] = normalize_language(lang)
         st['step'] = 'WAIT_EMAIL'
         _wa_set(sender, st)
-        _twilio_send_message(sender, "למי תרצה לתת הרשאת עריכה לשאלון שאני יוצר?\nענה עם כתובת אימייל תקינה (או כתוב 'skip' כדי לדלג).")
+        _twilio_reply(sender, "למי תרצה לתת הרשאת עריכה לשאלון שאני יוצר?\nענה עם כתובת אימייל תקינה (או כתוב 'skip' כדי לדלג).")
         return ("ok", 200)
 
     # Step 4: editor email
     if step == 'WAIT_EMAIL':
-        if body.strip().lower() in ('skip', 'דלג', 'לא', 'none'):
+        if body.lower() in _WA_SKIP_WORDS:
             st['share_with'] = None
         else:
             if not _is_valid_email(body):
-                _twilio_send_message(sender, "נראה שכתובת האימייל לא תקינה. אנא שלח אימייל תקין (לדוגמה: you@example.com) או כתוב 'skip' כדי לדלג.")
+                _twilio_reply(sender, "נראה שכתובת האימייל לא תקינה. אנא שלח אימייל תקין (לדוגמה: you@example.com) או כתוב 'skip' כדי לדלג.")
                 return ("ok", 200)
             st['share_with'] = body.strip()
 
         st['step'] = 'PROCESSING'
+        st['job'] = uuid.uuid4().hex
+        st['started_at'] = time.time()
         _wa_set(sender, st)
 
-        _twilio_send_message(sender, "מעולה ✅ תן לי להכין לך את השאלון… זה יכול לקחת כמה דקות.")
-
-        # Run pipeline
-        pdf_path = st.get('pdf_path')
-        tmpdir = st.get('tmpdir')
-        num_questions = st.get('num_questions') or 6
-        language = st.get('language') or 'en'
-        model = (os.getenv('WHATSAPP_MODEL') or 'gpt-4.1').strip()
-        share_with = st.get('share_with')
-
-        try:
-            if not pdf_path or not tmpdir or not os.path.exists(pdf_path):
-                raise RuntimeError('Missing PDF in session. Please send the PDF again.')
-
-            result = _run_pipeline_on_pdf_path(
-                pdf_path,
-                num_questions=num_questions,
-                language=language,
-                model=model,
-                share_with=share_with,
-                tmpdir=tmpdir,
-            )
-
-            form_edit_url = (result.get('form_edit_url') or '').strip()
-            links = _derive_form_links(form_edit_url)
-
-            # ✅ Update the "current quiz" pointer so /current-form points to the latest quiz response link
-            try:
-                target_path = _resolve_current_form_json_path()
-                _atomic_write_json(target_path, {
-                    'active_form_url': links['view'],          # viewform (response link)
-                    'active_responses_url': links['responses'] # edit#responses
-                })
-            except Exception as e:
-                logger.error(f"Failed to update current form: {e}")
-
-            # ✅ Stable links (constant endpoints on your Cloud Run service)
-            stable_view_link = f"{request.url_root.rstrip('/')}/current-form"
-            stable_responses_link = f"{request.url_root.rstrip('/')}/current-responses"
-
-            if links['edit']:
-                msg = (
-                    "✅ סיימתי! הנה הקישורים:\n"
-                    f"1) קישור לעריכה: {links['edit']}\n"
-                    f"2) קישור למענה (קבוע): {stable_view_link}\n"
-                    f"3) צפייה בתשובות (קבוע): {stable_responses_link}"
-                )
-                _twilio_send_message(sender, msg)
-            else:
-                _twilio_send_message(sender, "❌ יצירת הטופס נכשלה (לא התקבל קישור). בדוק לוגים.")
+        _twilio_reply(sender, "מעולה ✅ תן לי להכין לך את השאלון… זה יכול לקחת כמה דקות.")
 
-        except Exception as e:
-            logger.error(f"WhatsApp Twilio pipeline error: {e}")
-            logger.error(traceback.format_exc())
-            try:
-                _twilio_send_message(sender, f"❌ נכשל: {e}")
-            except Exception:
-                pass
-
-        finally:
-            # Cleanup
-            try:
-                if pdf_path and os.path.exists(pdf_path):
-                    os.remove(pdf_path)
-            except Exception:
-                pass
-            try:
-                if tmpdir and os.path.isdir(tmpdir):
-                    # Best-effort: leave dir if deletion fails
-                    for fn in os.listdir(tmpdir):
-                        try:
-                            os.remove(os.path.join(tmpdir, fn))
-                        except Exception:
-                            pass
-                    try:
-                        os.rmdir(tmpdir)
-                    except Exception:
-                        pass
-            except Exception:
-                pass
-            _wa_clear(sender)
+        # Run pipeline in the background; the result is sent as a new message
+        _PIPELINE_EXECUTOR.submit(_whatsapp_pipeline_job, sender, dict(st), request.url_root.rstrip('/'))
+        return ("ok", 200)
 
+    # Pipeline running in the background; don't reset the conversation under it
+    if step == 'PROCESSING':
+        _twilio_reply(sender, "אני עדיין מכין את השאלון ⏳ אשלח את הקישורים ברגע שיהיה מוכן.")
         return ("ok", 200)
 
     # Fallback: unknown state
     _wa_reset(sender)
-    _twilio_send_message(sender, "בוא נתחיל מחדש 🙂\nשלח לי בבקשה את קובץ ה-PDF.")
-    return ("ok", 200)
\ No newline at end of file
+    _twilio_reply(sender, "בוא נתחיל מחדש 🙂\nשלח לי בבקשה את קובץ ה-PDF.")
+    return ("ok", 200)
+
+
+if __name__ == "__main__":
+    # Get port from environment variable (Cloud Run) or default to 5050 for local dev
+    port = int(os.getenv('PORT', 5050))
+    host = os.getenv('HOST', '127.0.0.1')
+    
+    logger.info("Starting Flask server...")
+    logger.info(f"Open http://{host}:{port} in your browser")
+    logger.info("Login with password: changeme (or set PIPELINE_PASSWORD in .env)")
+    # Dev server only (production runs under gunicorn, see Procfile); debug is opt-in
+    debug = os.getenv('FLASK_DEBUG', '0').strip().lower() in ('1', 'true', 'yes')
+    app.run(host=host, port=port, debug=debug, threaded=True)
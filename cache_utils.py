@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Cache utilities for generated MCQ JSON, keyed on the PDF content and generation parameters.
+
+Entries are stored in Redis when REDIS_URL is set (shared across instances),
+otherwise as files under /tmp (writable tmpfs on Cloud Run), so a repeat
+upload of the same PDF with the same settings skips the OpenAI call.
+"""
+
+import functools
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from typing import Optional
+
+# Optional: BLAKE3 (SIMD hashing, several times faster than SHA-256 on large PDFs)
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+# Optional: Redis (shared cache across Cloud Run instances)
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+MCQ_CACHE_DIR = "/tmp/medtrain_mcq_cache"
+MCQ_CACHE_TTL = 7 * 24 * 3600  # seconds; override with MCQ_CACHE_TTL_SECONDS
+
+
+def _cache_ttl() -> int:
+    # Read on use, not at import, so .env files loaded by the app count
+    try:
+        return int(os.getenv("MCQ_CACHE_TTL_SECONDS") or MCQ_CACHE_TTL)
+    except ValueError:
+        return MCQ_CACHE_TTL
+
+
+def file_digest(path: str) -> str:
+    """
+    Hash a file's bytes with BLAKE3 when installed, otherwise SHA-256.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: Hex digest; BLAKE3 digests carry a "b3-" prefix so the two never collide.
+    """
+    with open(path, "rb", buffering=0) as f:
+        if blake3 is not None:
+            h = blake3()
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+            return f"b3-{h.hexdigest()}"
+        if hasattr(hashlib, "file_digest"):  # Python 3.11+
+            return hashlib.file_digest(f, "sha256").hexdigest()
+        h = hashlib.sha256()
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+        return h.hexdigest()
+
+
+def bytes_digest(data: bytes) -> str:
+    """
+    Hash in-memory bytes (e.g. an uploaded PDF) like file_digest.
+
+    Returns:
+        str: Hex digest, identical to file_digest of the same content.
+    """
+    if blake3 is not None:
+        return f"b3-{blake3(data).hexdigest()}"
+    return hashlib.sha256(data).hexdigest()
+
+
+def mcq_cache_key(pdf_digest: str, num_questions: int, language: str, model: str) -> str:
+    """
+    Build the cache key for a generation request.
+
+    Returns:
+        str: Key of the form "mcq:{digest}:{language}:{num_questions}:{model}".
+    """
+    return f"mcq:{pdf_digest}:{language}:{num_questions}:{model}"
+
+
+def mcq_text_cache_key(text: str, num_questions: int, language: str, model: str) -> str:
+    """
+    Build the cache key for a request from the PDF's extracted text.
+
+    Catches re-saved or re-exported PDFs whose bytes differ but whose text does not.
+
+    Returns:
+        str: Key of the form "mcq:text:{digest}:{language}:{num_questions}:{model}".
+    """
+    return f"mcq:text:{bytes_digest(text.encode('utf-8'))}:{language}:{num_questions}:{model}"
+
+
+@functools.lru_cache(maxsize=1)
+def redis_client():
+    """Return a Redis client when REDIS_URL is set and redis is installed, else None.
+
+    Resolved on first use (not at import) so .env files loaded by the app count.
+    """
+    url = (os.getenv("REDIS_URL") or "").strip()
+    if not url:
+        return None
+    if redis is None:
+        logging.warning("REDIS_URL is set but the redis package is not installed; using the /tmp cache")
+        return None
+    return redis.Redis.from_url(url, socket_timeout=2, socket_connect_timeout=2)
+
+
+def _entry_path(key: str) -> str:
+    # Keys may contain characters that are not safe in file names (e.g. model names)
+    name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+    return os.path.join(MCQ_CACHE_DIR, f"{name}.json")
+
+
+def get_cached_mcqs(key: str) -> Optional[bytes]:
+    """
+    Return the cached MCQ JSON for key, or None on a miss or expired entry.
+    """
+    client = redis_client()
+    if client is not None:
+        try:
+            return client.get(key)
+        except redis.RedisError as e:
+            logging.warning(f"Redis cache read failed, using the /tmp cache: {e}")
+
+    path = _entry_path(key)
+    try:
+        if time.time() - os.path.getmtime(path) > _cache_ttl():
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def put_cached_mcqs(key: str, blob: bytes) -> None:
+    """
+    Store MCQ JSON bytes under key. Best-effort: failures are swallowed.
+    """
+    client = redis_client()
+    if client is not None:
+        try:
+            client.set(key, blob, ex=_cache_ttl())
+            return
+        except redis.RedisError as e:
+            logging.warning(f"Redis cache write failed, using the /tmp cache: {e}")
+
+    try:
+        os.makedirs(MCQ_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".tmp_mcq_", dir=MCQ_CACHE_DIR)
+        with os.fdopen(fd, "wb") as f:
+            f.write(blob)
+        os.replace(tmp_path, _entry_path(key))
+    except OSError:
+        pass
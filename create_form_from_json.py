@@ -32,19 +32,18 @@ Environment Variables:
 
 import sys
 import os
-import json
-import pickle
+import functools
+import orjson
 import logging
+import threading
 from dotenv import load_dotenv, find_dotenv
 from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from googleapiclient.discovery import build
-from google.oauth2 import service_account
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-from pdf_to_questions import generate_mcqs_to_file
-from token_utils import get_token_path, load_google_token, get_client_secret_path
+# google-api-python-client / google-auth / pdf_to_questions are imported where
+# they are used, so the CLI can validate its inputs without loading them
+from token_utils import get_token_path, load_google_token, save_google_token, get_client_secret_path
 
 import traceback
 import time
@@ -79,8 +78,8 @@ def setup_logging(verbosity: int = 1):
     # Clear any existing handlers
     logger.handlers.clear()
     
-    # Create console handler
-    console_handler = logging.StreamHandler(sys.stdout)
+    # Create console handler (stderr, so stdout only carries the form URL)
+    console_handler = logging.StreamHandler()
     console_handler.setLevel(level)
     
     # Create formatter (same format as PdfToQuestions.py)
@@ -99,16 +98,21 @@ def setup_logging(verbosity: int = 1):
     return logger
 
 
+# The log gates are read once, on first use (after .env has been loaded), and
+# then served from cache; they are consulted for every question and API call.
+@functools.lru_cache(maxsize=1)
 def should_show_detailed_logs() -> bool:
     """Check if detailed logs should be shown."""
     return os.getenv("GOOGLE_FORMS_SHOW_DETAILED_LOGS", "false").lower() in ("true", "1", "yes")
 
 
+@functools.lru_cache(maxsize=1)
 def should_show_auth_logs() -> bool:
     """Check if authentication details should be logged."""
     return os.getenv("GOOGLE_FORMS_SHOW_AUTH_LOGS", "false").lower() in ("true", "1", "yes")
 
 
+@functools.lru_cache(maxsize=1)
 def should_show_api_logs() -> bool:
     """Check if API call details should be logged."""
     return os.getenv("GOOGLE_FORMS_SHOW_API_LOGS", "false").lower() in ("true", "1", "yes")
@@ -135,13 +139,6 @@ def log(msg: str, level: str = "info"):
     
     log_func = level_map.get(level.lower(), logger.info)
     log_func(msg)
-    
-    # Also print to console for compatibility
-    print(f"[mcq-forms] {msg}")
-    try:
-        sys.stdout.flush()
-    except Exception:
-        pass
 
 
 # Scopes: Forms body (create/edit), Forms responses (read), Drive (sharing/visibility)
@@ -154,31 +151,74 @@ SCOPES = [
 # Token and client secret paths are now managed by token_utils module
 
 
+# Credentials per token path, shared by every form created in this process.
+# The lock keeps concurrent pipeline jobs from loading/refreshing the token at once.
+_CREDS_CACHE: dict = {}
+_CREDS_LOCK = threading.Lock()
+
+# API clients per thread: googleapiclient clients (httplib2) are not thread-safe
+_SERVICE_LOCAL = threading.local()
+
+# Drive folder lookups overlapping form creation. Long-lived threads, so each
+# keeps its Drive client in _SERVICE_LOCAL across forms.
+_FOLDER_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix='mcq-forms-drive')
+
+
+def _get_service(name: str, version: str, creds):
+    """Return this thread's API client for (name, version), rebuilt only when creds change."""
+    cache = getattr(_SERVICE_LOCAL, "cache", None)
+    if cache is None:
+        cache = _SERVICE_LOCAL.cache = {}
+    entry = cache.get((name, version))
+    if entry is None or entry[0] is not creds:
+        # Bundled discovery doc: no HTTPS fetch of the discovery JSON per client
+        from googleapiclient.discovery import build
+        service = build(name, version, credentials=creds, cache_discovery=False, static_discovery=True)
+        entry = cache[(name, version)] = (creds, service)
+    return entry[1]
+
+
 def get_oauth_creds():
-    """Obtain/reuse OAuth user credentials with lazy loading and Cloud Run support."""
+    """Obtain/reuse OAuth user credentials with lazy loading and Cloud Run support.
+
+    The token is read from disk once per process; afterwards the cached
+    credentials are returned, and refreshed only when they expire.
+    """
+    token_path = get_token_path()
+    with _CREDS_LOCK:
+        creds = _CREDS_CACHE.get(token_path)
+        if creds is not None and creds.valid:
+            return creds
+        creds = _load_oauth_creds(creds)
+        _CREDS_CACHE[token_path] = creds
+        return creds
+
+
+def _load_oauth_creds(creds=None):
     log("Authentication mode: OAuth (user)", "info")
     
     if should_show_auth_logs():
         log("Starting OAuth authentication process", "debug")
     
-    # Try to load existing token first (lazy loading)
-    creds = None
-    try:
-        creds = load_google_token()
-        log(f"Found existing token file: {get_token_path()} — loading…", "info")
-        if should_show_auth_logs():
-            log("Token loaded successfully from file", "debug")
-    except FileNotFoundError as e:
-        log(f"Token file not found: {e}", "info")
-        creds = None
-    except Exception as e:
-        log(f"Failed to load token file: {e}", "warning")
-        creds = None
+    # Try to load existing token first (lazy loading), unless we hold expired cached ones
+    if creds is None:
+        try:
+            creds = load_google_token()
+            log(f"Found existing token file: {get_token_path()} — loading…", "info")
+            if should_show_auth_logs():
+                log("Token loaded successfully from file", "debug")
+        except FileNotFoundError as e:
+            log(f"Token file not found: {e}", "info")
+            creds = None
+        except Exception as e:
+            log(f"Failed to load token file: {e}", "warning")
+            creds = None
     
     if not creds or not creds.valid:
         if creds and getattr(creds, "expired", False) and getattr(creds, "refresh_token", None):
             log("Token expired; attempting refresh…", "info")
             try:
+                from google.auth.transport.requests import Request
                 creds.refresh(Request())
                 log("Token refresh successful", "info")
                 if should_show_auth_logs():
@@ -194,6 +234,7 @@ def get_oauth_creds():
                 raise FileNotFoundError(f"OAuth client secret file not found: {client_secret_file}")
             
             try:
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(client_secret_file, SCOPES)
                 creds = flow.run_local_server(port=0)
                 log("OAuth consent completed successfully", "info")
@@ -205,10 +246,8 @@ def get_oauth_creds():
         
         # Save the credentials to the appropriate location
         try:
-            token_path = get_token_path()
-            with open(token_path, "wb") as token:
-                pickle.dump(creds, token)
-                log(f"Saved credentials to {token_path}", "info")
+            token_path = save_google_token(creds)
+            log(f"Saved credentials to {token_path}", "info")
         except Exception as e:
             log(f"Warning: Failed to save credentials: {e}", "warning")
     else:
@@ -225,6 +264,13 @@ essential_sa_hint = (
 )
 
 
+@functools.lru_cache(maxsize=4)
+def _sa_creds_from_json(key_json: bytes):
+    """Parse a Service Account key once; the credentials are reused while the key is unchanged."""
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_info(orjson.loads(key_json), scopes=SCOPES)
+
+
 def get_sa_creds(sa_file: Optional[str]):
     """Load Service Account credentials from file (path or $SERVICE_ACCOUNT_FILE)."""
     key_path = sa_file or os.environ.get("SERVICE_ACCOUNT_FILE")
@@ -237,12 +283,15 @@ def get_sa_creds(sa_file: Optional[str]):
         log("ERROR: No Service Account key file provided", "error")
         raise SystemExit(essential_sa_hint)
     
-    if not os.path.exists(key_path):
+    try:
+        with open(key_path, "rb") as f:
+            key_json = f.read()
+    except FileNotFoundError:
         log(f"ERROR: Service Account key file not found: {key_path}", "error")
         raise FileNotFoundError(f"Service Account key file not found: {key_path}")
     
     try:
-        creds = service_account.Credentials.from_service_account_file(key_path, scopes=SCOPES)
+        creds = _sa_creds_from_json(key_json)
         log("Service Account credentials loaded successfully", "info")
         if should_show_auth_logs():
             log(f"Loaded credentials for service account from: {key_path}", "debug")
@@ -252,8 +301,124 @@ def get_sa_creds(sa_file: Optional[str]):
     
     return creds
 
-def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: Optional[str] = None, share_with: Optional[str] = None):
-    """Create Google Form from MCQ JSON file with comprehensive logging."""
+def find_or_create_folder(creds, folder_name: str) -> str:
+    """Return the id of the Drive folder named folder_name, creating it if missing.
+
+    Uses its own thread's Drive client so it can run on a worker thread while the
+    form is being created (googleapiclient clients are not thread-safe).
+    """
+    drive_service = _get_service("drive", "v3", creds)
+    # Escape any single quotes in the folder name for Drive query syntax
+    escaped_name = folder_name.replace("'", "\\'")
+    query = f"mimeType='application/vnd.google-apps.folder' and name='{escaped_name}' and trashed=false"
+    search = drive_service.files().list(q=query, fields="files(id, name)", pageSize=1).execute()
+    files = search.get("files", [])
+    if files:
+        folder_id = files[0]["id"]
+        log(f"Found existing folder: {folder_name} ({folder_id})", "info")
+        return folder_id
+
+    log(f"Folder not found. Creating: {folder_name}", "info")
+    new_folder = drive_service.files().create(
+        body={
+            "name": folder_name,
+            "mimeType": "application/vnd.google-apps.folder",
+        },
+        fields="id, name"
+    ).execute()
+    log(f"Created folder: {folder_name} ({new_folder['id']})", "info")
+    return new_folder["id"]
+
+
+def _build_question_requests(questions: list, detailed: bool):
+    """Build the createItem/updateItem requests for all questions.
+
+    Returns (requests, processed_count). Questions that fail to convert are
+    skipped; grading is only added when the answer is one of the options.
+    Items are appended in JSON order after the name question at index 0.
+    """
+    total_qs = len(questions)
+    requests = []
+    add = requests.append
+    processed_count = 0
+    idx = 1  # next free position; index 0 holds the name question
+
+    for i, q in enumerate(questions, 1):
+        try:
+            stem = q.get("stem", "Untitled question")
+            options = [{"value": opt["text"]} for opt in q.get("options", ())]
+            correct = (q.get("answer") or {}).get("text", "")
+
+            if detailed:
+                log(f"Processing question {i}/{total_qs}: {stem[:50]}...", "debug")
+                log(f"  Question {i} details:", "debug")
+                log(f"    Stem: {stem[:100]}...", "debug")
+                log(f"    Options: {len(options)}", "debug")
+                log(f"    Correct answer: {correct[:50]}...", "debug")
+                log(f"    Rationale: {q.get('rationale', 'N/A')[:50]}...", "debug")
+
+            # Add question
+            add({
+                "createItem": {
+                    "item": {
+                        "title": stem,
+                        "questionItem": {
+                            "question": {
+                                "required": True,
+                                "choiceQuestion": {
+                                    "type": "RADIO",
+                                    "options": options,
+                                    "shuffle": False,
+                                }
+                            }
+                        }
+                    },
+                    "location": {"index": idx}
+                }
+            })
+            item_idx = idx
+            idx += 1
+            processed_count += 1
+
+            # Validate 'correct' is among options before adding grading
+            if not any(o["value"] == correct for o in options):
+                log(f"⚠️  Correct answer not found among options for question {i}; skipping grading for this item.", "warning")
+                continue
+
+            # Add grading (answer key, without feedback fields)
+            add({
+                "updateItem": {
+                    "item": {
+                        "title": stem,
+                        "questionItem": {
+                            "question": {
+                                "grading": {
+                                    "pointValue": 1,
+                                    "correctAnswers": {"answers": [{"value": correct}]}
+                                }
+                            }
+                        }
+                    },
+                    "location": {"index": item_idx},
+                    "updateMask": "questionItem.question.grading"
+                }
+            })
+
+        except Exception as e:
+            log(f"⚠️  Failed to process question {i}: {e}", "warning")
+            if detailed:
+                log(f"Question {i} error details:", "debug")
+                traceback.print_exc()
+
+    return requests, processed_count
+
+
+def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: Optional[str] = None, share_with: Optional[str] = None, data: Optional[dict] = None):
+    """Create Google Form from MCQ JSON file with comprehensive logging.
+
+    If the caller already holds the parsed MCQ payload it can pass it as data;
+    json_path is then only logged and the file is not read again.
+    """
     
     # Log startup information
     log("=" * 60, "info")
@@ -268,11 +433,12 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
     log(f"  API Logs: {should_show_api_logs()}", "info")
     
     # Validate input file
-    if not os.path.exists(json_path):
-        log(f"ERROR: JSON file not found: {json_path}", "error")
-        raise FileNotFoundError(f"JSON file not found: {json_path}")
-    
-    log(f"JSON file validation: {json_path} exists", "info")
+    if data is None:
+        if not os.path.exists(json_path):
+            log(f"ERROR: JSON file not found: {json_path}", "error")
+            raise FileNotFoundError(f"JSON file not found: {json_path}")
+
+        log(f"JSON file validation: {json_path} exists", "info")
     
     # Authentication
     log("Starting authentication process...", "info")
@@ -297,7 +463,7 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
     # Build Google Forms service
     log("Building Google Forms service...", "info")
     try:
-        forms_service = build("forms", "v1", credentials=creds)
+        forms_service = _get_service("forms", "v1", creds)
         log("✅ Google Forms service initialized", "info")
         if should_show_api_logs():
             log("Forms API client ready for operations", "debug")
@@ -305,6 +471,13 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
         log(f"❌ Failed to initialize Forms service: {e}", "error")
         raise
 
+    # Look up (or create) the target Drive folder while the form is being created
+    target_folder_name = (os.getenv("FORMS_TARGET_FOLDER_NAME") or "Medtrain Quizes").strip()
+    folder_future = None
+    if target_folder_name:
+        log(f"Ensuring Drive folder exists: '{target_folder_name}'", "info")
+        folder_future = _FOLDER_EXECUTOR.submit(find_or_create_folder, creds, target_folder_name)
+
     # Create empty form
     log("Creating empty Google Form...", "info")
     try:
@@ -345,37 +518,11 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
             traceback.print_exc()
         raise
 
-    # Ensure target folder exists and move the form into it
+    # Move the form into the target folder
     try:
-        target_folder_name = (os.getenv("FORMS_TARGET_FOLDER_NAME") or "Medtrain Quizes").strip()
-        if target_folder_name:
-            log(f"Ensuring Drive folder exists: '{target_folder_name}'", "info")
-            drive_service = build("drive", "v3", credentials=creds)
-
-            # Find folder by name
-            folder_id = None
-            # Escape any single quotes in the folder name for Drive query syntax
-            escaped_name = target_folder_name.replace("'", "\\'")
-            query = f"mimeType='application/vnd.google-apps.folder' and name='{escaped_name}' and trashed=false"
-            search = drive_service.files().list(q=query, fields="files(id, name)", pageSize=1).execute()
-            files = search.get("files", [])
-            if files:
-                folder_id = files[0]["id"]
-                log(f"Found existing folder: {target_folder_name} ({folder_id})", "info")
-            else:
-                # Create folder
-                log(f"Folder not found. Creating: {target_folder_name}", "info")
-                new_folder = drive_service.files().create(
-                    body={
-                        "name": target_folder_name,
-                        "mimeType": "application/vnd.google-apps.folder",
-                    },
-                    fields="id, name"
-                ).execute()
-                folder_id = new_folder["id"]
-                log(f"Created folder: {target_folder_name} ({folder_id})", "info")
-
-            # Move form file into the folder (update parents)
+        if folder_future is not None:
+            folder_id = folder_future.result()
+            drive_service = _get_service("drive", "v3", creds)
             meta = drive_service.files().get(fileId=form_id, fields="parents").execute()
             previous_parents = ",".join(meta.get("parents", [])) if meta.get("parents") else ""
             drive_service.files().update(
@@ -390,31 +537,13 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
         if should_show_detailed_logs():
             traceback.print_exc()
 
-    # Ensure the form is a quiz before setting grading
-    try:
-        quiz_toggle = {
-            "requests": [
-                {
-                    "updateSettings": {
-                        "settings": {
-                            "quizSettings": {"isQuiz": True}
-                        },
-                        "updateMask": "quizSettings.isQuiz"
-                    }
-                }
-            ]
-        }
-        forms_service.forms().batchUpdate(formId=form_id, body=quiz_toggle).execute()
-        log("✅ Form quiz mode enabled (quizSettings.isQuiz = true)", "info")
-    except Exception as e:
-        log(f"⚠️  Failed to enable quiz mode automatically (will continue): {e}", "warning")
-
     # Load and parse JSON
-    log(f"Loading MCQs from: {json_path}", "info")
+    log(f"Loading MCQs from: {json_path if data is None else 'in-memory payload'}", "info")
     try:
-        with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        
+        if data is None:
+            with open(json_path, "rb") as f:
+                data = orjson.loads(f.read())
+
         questions = data.get("questions", [])
         total_qs = len(questions)
         log(f"✅ JSON parsing completed: {total_qs} question(s) found", "info")
@@ -424,7 +553,7 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
             log(f"  Total questions: {total_qs}", "debug")
             log(f"  Source summary: {data.get('source_summary', 'N/A')[:100]}...", "debug")
             
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         log(f"❌ Invalid JSON format: {e}", "error")
         raise
     except Exception as e:
@@ -437,82 +566,21 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
         return
 
     log(f"Processing {total_qs} questions...", "info")
-    requests = []
-    processed_count = 0
-
-    for i, q in enumerate(questions, 1):
-        try:
-            if should_show_detailed_logs():
-                log(f"Processing question {i}/{total_qs}: {q.get('stem', 'Untitled')[:50]}...", "debug")
-
-            options = [{"value": opt["text"]} for opt in q.get("options", [])]
-            correct = (q.get("answer") or {}).get("text", "")
-
-            if should_show_detailed_logs():
-                log(f"  Question {i} details:", "debug")
-                log(f"    Stem: {q.get('stem', 'Untitled')[:100]}...", "debug")
-                log(f"    Options: {len(options)}", "debug")
-                log(f"    Correct answer: {correct[:50]}...", "debug")
-                log(f"    Rationale: {q.get('rationale', 'N/A')[:50]}...", "debug")
-
-            # Add question
-            requests.append({
-                "createItem": {
-                    "item": {
-                        "title": q.get("stem", "Untitled question"),
-                        "questionItem": {
-                            "question": {
-                                "required": True,
-                                "choiceQuestion": {
-                                    "type": "RADIO",
-                                    "options": options,
-                                    "shuffle": False,
-                                }
-                            }
-                        }
-                    },
-                    "location": {"index": 1}
-                }
-            })
-
-            # Validate 'correct' is among options before adding grading
-            option_values = [o["value"] for o in options if "value" in o]
-            if correct and correct not in option_values:
-                log(f"⚠️  Correct answer not found among options for question {i}; skipping grading for this item.", "warning")
-                continue
-
-            # Add grading (answer key, without feedback fields)
-            requests.append({
-                "updateItem": {
-                    "item": {
-                        "title": q.get("stem", "Untitled question"),
-                        "questionItem": {
-                            "question": {
-                                "grading": {
-                                    "pointValue": 1,
-                                    "correctAnswers": {"answers": [{"value": correct}]}
-                                }
-                            }
-                        }
-                    },
-                    "location": {"index": 1},
-                    "updateMask": "questionItem.question.grading"
-                }
-            })
-
-            processed_count += 1
-
-        except Exception as e:
-            log(f"⚠️  Failed to process question {i}: {e}", "warning")
-            if should_show_detailed_logs():
-                log(f"Question {i} error details:", "debug")
-                traceback.print_exc()
-            continue
+    requests, processed_count = _build_question_requests(questions, should_show_detailed_logs())
 
     log(f"✅ Question processing completed: {processed_count}/{total_qs} questions processed", "info")
 
     # Send batch update to Google Forms
     if requests:
+        # Turn the form into a quiz in the same call, ahead of the grading updates
+        requests.insert(0, {
+            "updateSettings": {
+                "settings": {
+                    "quizSettings": {"isQuiz": True}
+                },
+                "updateMask": "quizSettings.isQuiz"
+            }
+        })
         log(f"Sending batch update with {len(requests)} request objects to Google Forms...", "info")
         try:
             start_time = time.time()
@@ -535,15 +603,13 @@ def create_form_from_json(json_path: str, auth_method: str = "oauth", sa_file: O
     log("FORM CREATION COMPLETED SUCCESSFULLY", "info")
     log("=" * 60, "info")
     log(f"Form URL: {form_url}", "info")
-    log("⚠️  Remember: Open the form, go to Settings → Quizzes, and enable 'Make this a quiz'", "warning")
     print(f"\nForm created: {form_url}")
-    print("⚠️ Remember: open the form, go to Settings → Quizzes, and enable 'Make this a quiz'.")
 
     # Optional: Share form if using Service Account
     if auth_method == "sa" and share_with:
         log(f"Sharing form with {share_with} (Editor access)...", "info")
         try:
-            drive_service = build("drive", "v3", credentials=creds)
+            drive_service = _get_service("drive", "v3", creds)
             drive_service.permissions().create(
                 fileId=form_id,
                 body={
@@ -590,7 +656,8 @@ def run_pipeline_from_env():
 
     # Step 1: PDF -> MCQs JSON
     log("PIPELINE: Generating MCQs JSON from PDF…", "info")
-    combined_path = generate_mcqs_to_file(pdf_path, output_dir, model, num_questions)
+    from pdf_to_questions import generate_mcqs_to_file
+    combined_path, _ = generate_mcqs_to_file(pdf_path, output_dir, model, num_questions)
     log(f"PIPELINE: MCQs JSON ready → {combined_path}", "info")
 
     # Step 2: JSON -> Google Form
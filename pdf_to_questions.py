@@ -9,25 +9,64 @@ Generate MCQs from a PDF using OpenAI, with strict JSON output.
 - Saves one combined JSON file
 """
 
-import json
+import asyncio
+import io
 import logging
+import multiprocessing
+import orjson
 import os
+import re
+import shutil
+import subprocess
 import sys
 import traceback
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Literal
-
-import pdfplumber
+from typing import Dict, Any, List, Literal, Tuple
+
+# PDF text extraction: poppler's pdftotext if installed, then PyMuPDF, then pdfplumber
+PDFTOTEXT_BIN = shutil.which("pdftotext")
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 from openai.types.responses import Response
 from dotenv import load_dotenv, find_dotenv
 
+# pdfminer (pdfplumber's backend) logs per-object debug noise
+logging.getLogger("pdfminer").setLevel(logging.WARNING)
+
+# Structured breadcrumbs: one JSON object per stdout line (Cloud Logging parses these).
+# A logger rather than print(): the handler's lock keeps lines from concurrent
+# jobs whole, and a level check skips the encoding when events are switched off.
+_event_logger = logging.getLogger("medtrain.events")
+if not _event_logger.handlers:
+    _event_handler = logging.StreamHandler(sys.stdout)
+    _event_handler.setFormatter(logging.Formatter("%(message)s"))
+    _event_logger.addHandler(_event_handler)
+    _event_logger.setLevel(logging.INFO)
+    _event_logger.propagate = False
+
+
+def log_event(evt: str, **fields) -> None:
+    """Emit a structured breadcrumb {"evt": evt, **fields} as a JSON line on stdout."""
+    if _event_logger.isEnabledFor(logging.INFO):
+        _event_logger.info(orjson.dumps({"evt": evt, **fields}, default=str).decode("utf-8"))
+
 # Language constants
 LANG_EN = ("en", "english", "en-us", "en-gb")
 LANG_HE = ("he", "hebrew", "iw", "he-il")
 
+# Chunking / concurrency for large documents
+MAX_CHUNK_CHARS = 24000          # ~6k tokens of source text per completion
+OPENAI_MAX_CONCURRENCY = 8       # parallel completions per document (RPM guard)
+MCQ_BATCH_SIZE = 4               # chunks packed into one completion
+PDF_EXTRACT_WORKERS = min(os.cpu_count() or 1, 4)  # gains flatten out past ~4 processes
+PDF_PAGES_PER_WORKER = 25        # below this, process start-up costs more than it saves
+
 def normalize_language(raw: str | None) -> Literal["en", "he"]:
     """Normalize language input to standard values."""
     v = (raw or "").strip().lower()
@@ -56,31 +95,6 @@ def build_language_instructions(lang: Literal["en","he"]) -> str:
                 "שמור על RTL וסימני פיסוק.")
     return "All questions, choices, and explanations must be in clear English."
 
-def call_openai_generate_diagnostic(client, model, messages):
-    """Call OpenAI with comprehensive diagnostics and error handling."""
-    print(json.dumps({
-        "evt": "openai.call.start",
-        "model": model,
-        "key_present": bool(os.getenv("OPENAI_API_KEY")),
-    }), flush=True)
-    try:
-        resp = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=0,
-            timeout=120,  # keep under Cloud Run timeout
-        )
-        print(json.dumps({"evt": "openai.call.ok"}), flush=True)
-        return resp
-    except Exception as e:
-        print(json.dumps({
-            "evt": "openai.call.error",
-            "type": type(e).__name__,
-            "msg": str(e),
-        }), flush=True)
-        traceback.print_exc()
-        raise
-
 def build_prompts_from_inputs(text_chunk: str, language: str, num_questions: int):
     """Build OpenAI messages with proper language handling."""
     lang = normalize_language(language)
@@ -107,98 +121,276 @@ def setup_logging(verbosity: int = 1):
     )
 
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    logging.info(f"Opening PDF: {pdf_path}")
-    if not os.path.isfile(pdf_path):
-        raise FileNotFoundError(f"PDF not found: {pdf_path}")
+def _extract_pages_pdftotext(pdf_path: str | None, pdf_bytes: bytes | None = None) -> List[str]:
+    """Run poppler's pdftotext once for the whole file; pages are separated by form feeds."""
+    logging.info("Extracting text (pdftotext)...")
+    out = subprocess.run(
+        [PDFTOTEXT_BIN, "-layout", "-enc", "UTF-8", "-" if pdf_bytes is not None else pdf_path, "-"],
+        input=pdf_bytes,
+        capture_output=True,
+        check=True,
+        timeout=60,
+    ).stdout.decode("utf-8", errors="replace")
+    pages = out.split("\f")
+    if pages and not pages[-1].strip():
+        pages.pop()  # pdftotext terminates every page, including the last, with \f
+    return pages
+
+
+def _open_fitz(pdf_path: str | None, pdf_bytes: bytes | None = None):
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    return fitz.open(pdf_path)
+
+
+def _extract_range_pymupdf(pdf_path: str | None, start: int, end: int, pdf_bytes: bytes | None = None) -> List[str]:
+    """Extract pages [start, end) in a worker process; each worker opens its own document."""
+    pages_text: List[str] = []
+    with _open_fitz(pdf_path, pdf_bytes) as doc:
+        for i in range(start, end):
+            try:
+                pages_text.append(doc.load_page(i).get_text("text") or "")
+            except Exception as e:
+                logging.exception(f"Failed to extract text from page {i + 1}: {e}")
+                pages_text.append("")
+    return pages_text
+
+
+def _extract_pages_pymupdf(pdf_path: str | None, pdf_bytes: bytes | None = None) -> List[str]:
+    with _open_fitz(pdf_path, pdf_bytes) as doc:
+        page_count = doc.page_count
+    logging.info(f"PDF has {page_count} pages. Extracting text (PyMuPDF)...")
+
+    # PARALLEL_PDF=0 turns process sharding off (read per call: .env is loaded after import)
+    parallel = (os.getenv("PARALLEL_PDF") or "1").strip().lower() not in ("0", "false", "no")
+    workers = min(PDF_EXTRACT_WORKERS, page_count // PDF_PAGES_PER_WORKER) if parallel else 1
+    if workers <= 1:
+        return _extract_range_pymupdf(pdf_path, 0, page_count, pdf_bytes)
+
+    # Shard contiguous page ranges across processes. Spawned (not forked) workers,
+    # so this is safe to call from a threaded gunicorn worker's background thread.
+    step = -(-page_count // workers)
+    ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    with ProcessPoolExecutor(max_workers=len(ranges), mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [pool.submit(_extract_range_pymupdf, pdf_path, start, end, pdf_bytes) for start, end in ranges]
+        return [text for fut in futures for text in fut.result()]
+
+
+def _extract_pages_pdfplumber(pdf_path: str | None, pdf_bytes: bytes | None = None) -> List[str]:
+    import pdfplumber
 
     pages_text: List[str] = []
-    with pdfplumber.open(pdf_path) as pdf:
-        logging.info(f"PDF has {len(pdf.pages)} pages. Extracting text...")
+    with pdfplumber.open(io.BytesIO(pdf_bytes) if pdf_bytes is not None else pdf_path) as pdf:
+        logging.info(f"PDF has {len(pdf.pages)} pages. Extracting text (pdfplumber)...")
         for i, page in enumerate(pdf.pages, start=1):
             try:
-                page_text = page.extract_text() or ""
+                pages_text.append(page.extract_text() or "")
             except Exception as e:
                 logging.exception(f"Failed to extract text from page {i}: {e}")
-                page_text = ""
-            pages_text.append(f"\n\n===== PAGE {i} START =====\n{page_text}\n===== PAGE {i} END =====")
+                pages_text.append("")
+    return pages_text
 
-    full_text = "\n".join(pages_text).strip()
+
+def extract_text_from_pdf(pdf_path: str | None = None, pdf_bytes: bytes | None = None) -> str:
+    """Extract page-delimited text from a PDF on disk (pdf_path) or in memory (pdf_bytes)."""
+    if pdf_bytes is not None:
+        logging.info(f"Opening PDF from memory ({len(pdf_bytes)} bytes)")
+    else:
+        logging.info(f"Opening PDF: {pdf_path}")
+        if not pdf_path or not os.path.isfile(pdf_path):
+            raise FileNotFoundError(f"PDF not found: {pdf_path}")
+
+    # Native pdftotext is fastest and runs outside the GIL; PyMuPDF (C++ backed)
+    # is next; pdfplumber/pdfminer is the pure-Python last resort.
+    pages = None
+    if PDFTOTEXT_BIN:
+        try:
+            pages = _extract_pages_pdftotext(pdf_path, pdf_bytes)
+        except (subprocess.SubprocessError, OSError) as e:
+            logging.warning(f"pdftotext failed, falling back: {e}")
+    if pages is None:
+        if fitz is not None:
+            pages = _extract_pages_pymupdf(pdf_path, pdf_bytes)
+        else:
+            pages = _extract_pages_pdfplumber(pdf_path, pdf_bytes)
+
+    full_text = "\n".join(
+        f"\n\n===== PAGE {i} START =====\n{page_text}\n===== PAGE {i} END ====="
+        for i, page_text in enumerate(pages, start=1)
+    ).strip()
     logging.info(f"Extraction complete. Characters extracted: {len(full_text)}")
     return full_text
 
 
+# Shape of one question object, shared by the single and batched prompts
+QUESTION_SCHEMA = """{
+  "id": "string, unique like Q1, Q2 ...",
+  "topic": "string, short (e.g., 'Air Evacuation', 'Vascular Access', 'Heat Injury', 'Airway/Neck Trauma')",
+  "difficulty": "string, one of ['basic','intermediate','advanced']",
+  "stem": "string, the question stem in one paragraph, ≤ 320 chars, no line breaks",
+  "options": [
+    {"label":"A","text":"string, plausible distractor or correct answer"},
+    {"label":"B","text":"string"},
+    {"label":"C","text":"string"},
+    {"label":"D","text":"string"}
+  ],
+  "answer": {"label": "one of ['A','B','C','D']", "text": "string that exactly matches the chosen option text"},
+  "rationale": "string, ≤ 300 chars, why the correct answer is correct and why others are not appropriate in this context",
+  "operational_note": "string, ≤ 200 chars, practical field note (if applicable), else empty string",
+  "safety_flags": ["array of short strings for safety-critical cues present in the question, can be empty"]
+}"""
+
+CONTENT_GUARDRAILS = """Content guardrails:
+- Prefer single-best-answer MCQs.
+- Options must be mutually exclusive and collectively plausible.
+- Avoid ambiguous wording, double negatives, or local jargon without context.
+- Avoid exposing the answer in the question or the options.
+- Do not include sensitive PII."""
 
 
-def build_user_prompt(pdf_text: str, num_questions: int, language: str = 'en') -> str:
-    # Use the new language normalization
-    lang = normalize_language(language)
-    lang_instructions = build_language_instructions(lang)
-    
-    schema_instruction = f"""
-You are generating professional monthly mission **medical multiple-choice questions (MCQs)** from input text.
+# Fixed system prompt. It must stay byte-identical across calls (no dates, ids,
+# language or counts) and above 1024 tokens so OpenAI's automatic prompt cache
+# can reuse it; everything request-specific goes in the user message.
+MCQ_SYSTEM_PROMPT = f"""You are generating professional monthly mission **medical multiple-choice questions (MCQs)** from input text.
 Audience: trained medics. Content must be accurate, unambiguous, and operationally useful.
 Try to refer any single key takeaway from the text.
 
-{lang_instructions}
+The user message states the language, how many questions to write, and the source text.
+
+Return **ONLY** a single JSON object (no markdown, no code fences, no extra keys).
 
-Return **ONLY** a single JSON object that **exactly** matches this schema (no markdown, no code fences, no extra keys):
+When the source is a single text, the JSON object must **exactly** match this schema:
 
 {{
   "source_summary": "string, ≤ 400 chars concise summary of the key takeaways the questions are based on",
   "questions": [
+    {QUESTION_SCHEMA}
+  ]
+}}
+
+When the source is split into chunks delimited by "### CHUNK <id>" headers, write each chunk's
+questions from that chunk only and return this schema instead, with one entry per chunk in chunk order:
+
+{{
+  "batches": [
     {{
-      "id": "string, unique like Q1, Q2 ...",
-      "topic": "string, short (e.g., 'Air Evacuation', 'Vascular Access', 'Heat Injury', 'Airway/Neck Trauma')",
-      "difficulty": "string, one of ['basic','intermediate','advanced']",
-      "stem": "string, the question stem in one paragraph, ≤ 320 chars, no line breaks",
-      "options": [
-        {{"label":"A","text":"string, plausible distractor or correct answer"}},
-        {{"label":"B","text":"string"}},
-        {{"label":"C","text":"string"}},
-        {{"label":"D","text":"string"}}
-      ],
-      "answer": {{"label": "one of ['A','B','C','D']", "text": "string that exactly matches the chosen option text"}},
-      "rationale": "string, ≤ 300 chars, why the correct answer is correct and why others are not appropriate in this context",
-      "operational_note": "string, ≤ 200 chars, practical field note (if applicable), else empty string",
-      "safety_flags": ["array of short strings for safety-critical cues present in the question, can be empty"]
+      "id": "integer, the chunk id",
+      "source_summary": "string, ≤ 400 chars concise summary of the chunk's key takeaways",
+      "questions": [
+        {QUESTION_SCHEMA}
+      ]
     }}
   ]
 }}
 
 Hard constraints:
-- Produce **exactly {num_questions}** questions in "questions".
+- Produce **exactly** the number of questions requested in the user message, never more.
 - Use **clear, field-proven guidance** from the text; **do not invent** protocols.
 - No references/citations or page numbers in the JSON.
 - **Do not** include any text before or after the JSON.
 - **Do not** include code fences, markdown, or comments.
 
-Content guardrails:
-- Prefer single-best-answer MCQs.
-- Options must be mutually exclusive and collectively plausible.
-- Avoid ambiguous wording, double negatives, or local jargon without context.
-- Avoid exposing the answer in the question or the options.
-- Do not include sensitive PII.
+{CONTENT_GUARDRAILS}
+
+Quality rubric (apply to every question before returning):
+1. Relevance: the stem tests a takeaway that is explicitly stated in the source text, not general trivia.
+2. Single best answer: exactly one option is correct in the context of the source; the others are wrong for a stated reason.
+3. Plausible distractors: wrong options reflect realistic field mistakes (wrong sequence, wrong threshold, wrong drug or dose, wrong priority), not absurd choices.
+4. Parallel options: all four options have similar length, grammar and level of detail so the answer cannot be guessed from form.
+5. No giveaways: avoid "all of the above", "none of the above", absolute words used only in distractors, and repeating stem words only in the correct option.
+6. Clinical safety: never present an unsafe action as correct; when the source warns about a hazard, prefer a question that tests recognition of that hazard and list it in "safety_flags".
+7. Difficulty mix: label "basic" for recall of a single fact, "intermediate" for applying a rule to a scenario, "advanced" for prioritising between competing actions.
+8. Answer key: "answer.label" matches the option label and "answer.text" is copied character for character from that option.
+9. Rationale: explain in one or two sentences why the answer is correct and why the most tempting distractor is not.
+10. Operational note: a short practical tip a medic can use in the field, or an empty string when the source offers none.
+11. Coverage: spread questions across different takeaways; do not ask two questions about the same fact.
+12. Scenario framing: intermediate and advanced stems describe a short, concrete field situation (patient, mechanism, setting) before asking what to do.
+
+Example of one well-formed question object (for format and style only; do not reuse its content):
+
+{{
+  "id": "Q1",
+  "topic": "Heat Injury",
+  "difficulty": "intermediate",
+  "stem": "During a midday march a soldier becomes confused and stops sweating; core temperature is 40.5°C. What is the first priority after moving him to shade?",
+  "options": [
+    {{"label": "A", "text": "Start aggressive whole-body cooling immediately"}},
+    {{"label": "B", "text": "Give oral fluids and reassess in 30 minutes"}},
+    {{"label": "C", "text": "Evacuate first and begin cooling on arrival"}},
+    {{"label": "D", "text": "Administer an antipyretic and monitor temperature"}}
+  ],
+  "answer": {{"label": "A", "text": "Start aggressive whole-body cooling immediately"}},
+  "rationale": "Altered mental status with hyperthermia indicates heat stroke; rapid cooling is time-critical. Antipyretics do not work and delaying cooling for evacuation worsens outcome.",
+  "operational_note": "Cool first, transport second: use ice sheets or water and fanning en route if evacuation is needed.",
+  "safety_flags": ["altered mental status", "heat stroke"]
+}}
+"""
+
+
+def build_user_prompt(pdf_text: str, num_questions: int, language: str = 'en') -> str:
+    """User message for a single source text: language, question count and the text."""
+    lang = normalize_language(language)
+    lang_instructions = build_language_instructions(lang)
+    return f"""{lang_instructions}
+Produce **exactly {num_questions}** questions in "questions".
 
 Here is the source text to base your questions on:
 ---
 {pdf_text}
 ---
 """
-    return schema_instruction
 
 
-def init_openai_client() -> OpenAI:
-    logging.info("Initializing OpenAI client...")
+def build_batch_user_prompt(chunks: List[str], counts: List[int], language: str = 'en') -> str:
+    """User message covering several text chunks; the model answers per chunk id."""
+    lang = normalize_language(language)
+    lang_instructions = build_language_instructions(lang)
+    per_chunk = "\n".join(f"- CHUNK {i}: exactly {n} question(s)" for i, n in enumerate(counts, start=1))
+    sources = "\n\n".join(f"### CHUNK {i}\n{chunk}" for i, chunk in enumerate(chunks, start=1))
+    return f"""{lang_instructions}
+The source text is split into {len(chunks)} chunks. Return the "batches" schema with:
+{per_chunk}
+
+Here is the source text to base your questions on:
+---
+{sources}
+---
+"""
+
+
+def build_mcq_messages(user_prompt: str) -> List[Dict[str, str]]:
+    """Pair the fixed system prompt with a request-specific user message."""
+    return [
+        {"role": "system", "content": MCQ_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt},
+    ]
+
+
+def split_batch_payload(payload: Dict[str, Any], num_chunks: int) -> List[Dict[str, Any]]:
+    """Map a batched response back to one payload per chunk (ids are 1-based)."""
+    by_id: Dict[int, Dict[str, Any]] = {}
+    for entry in payload.get("batches") or []:
+        try:
+            by_id[int(entry.get("id"))] = entry
+        except (AttributeError, TypeError, ValueError):
+            continue
+
+    results: List[Dict[str, Any]] = []
+    for i in range(1, num_chunks + 1):
+        entry = by_id.get(i)
+        if entry is None:
+            logging.warning(f"Batched response is missing chunk {i}")
+            results.append({"_error": "missing_batch", "_batch_id": i, **{k: v for k, v in payload.items() if k.startswith("_")}})
+        else:
+            results.append({"source_summary": entry.get("source_summary", ""), "questions": entry.get("questions")})
+    return results
+
+
+def init_async_openai_client() -> AsyncOpenAI:
+    logging.info("Initializing async OpenAI client...")
     if not os.getenv("OPENAI_API_KEY"):
         raise EnvironmentError("OPENAI_API_KEY is not set.")
-    try:
-        client = OpenAI()
-        logging.info("OpenAI client initialized.")
-        return client
-    except Exception as e:
-        logging.exception("Failed to initialize OpenAI client.")
-        raise e
+    return AsyncOpenAI()
 
 
 @retry(
@@ -260,91 +452,236 @@ def call_openai_generate(
         logging.debug("Received text via Chat Completions (no response_format).")
 
     try:
-        data = json.loads(text)
+        data = orjson.loads(text)
         logging.info("Parsed JSON from model successfully.")
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         logging.error("Model did not return valid JSON. Saving raw text for inspection.")
         data = {"_raw_text": text, "_error": "json_decode_failed", "_exception": str(e)}
 
     return data
 
-def generate_mcqs_to_file(pdf_path: str, output_dir: str, model: str, num_questions: int, language: str = 'en') -> str:
-    """Generate MCQs from a PDF and write one combined JSON. Returns the JSON path."""
+def parse_mcq_json(text_content: str) -> Dict[str, Any]:
+    """Parse the model output into a dict, recovering JSON wrapped in markdown or extra text."""
+    logging.info(f"Raw OpenAI response length: {len(text_content)}")
+    logging.info(f"Raw response preview: {text_content[:200]}...")
+
+    try:
+        payload = orjson.loads(text_content)
+        logging.info(f"✅ Successfully parsed JSON with {len(payload.get('questions', []))} questions")
+    except orjson.JSONDecodeError as e:
+        logging.error(f"❌ JSON parsing failed: {e}")
+        logging.error(f"📄 Raw OpenAI response (first 500 chars):")
+        logging.error(f"{text_content[:500]}")
+        logging.error(f"📄 Raw OpenAI response (last 500 chars):")
+        logging.error(f"{text_content[-500:]}")
+
+        # Try to extract JSON from the response if it's wrapped in markdown
+        json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text_content, re.DOTALL)
+        if json_match:
+            logging.info(f"🔍 Found JSON in markdown, attempting extraction...")
+            try:
+                payload = orjson.loads(json_match.group(1))
+                logging.info(f"✅ Successfully extracted JSON from markdown with {len(payload.get('questions', []))} questions")
+            except orjson.JSONDecodeError as e2:
+                logging.error(f"❌ Failed to parse extracted JSON: {e2}")
+                logging.error(f"📄 Extracted JSON: {json_match.group(1)[:200]}...")
+                payload = {"_raw_text": text_content, "_error": "json_decode_failed", "_exception": str(e2)}
+        else:
+            logging.error(f"❌ No JSON found in markdown format")
+            # Try to find the first { and last } to extract JSON
+            first_brace = text_content.find('{')
+            last_brace = text_content.rfind('}')
+            if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
+                potential_json = text_content[first_brace:last_brace+1]
+                logging.info(f"🔍 Attempting to extract JSON from position {first_brace} to {last_brace}")
+                try:
+                    payload = orjson.loads(potential_json)
+                    logging.info(f"✅ Successfully extracted JSON from position with {len(payload.get('questions', []))} questions")
+                except orjson.JSONDecodeError as e3:
+                    logging.error(f"❌ Failed to parse position-extracted JSON: {e3}")
+                    payload = {"_raw_text": text_content, "_error": "json_decode_failed", "_exception": str(e3)}
+            else:
+                payload = {"_raw_text": text_content, "_error": "json_decode_failed", "_exception": str(e)}
+    return payload
+
+
+def split_text_into_chunks(text: str, num_questions: int, max_chars: int = MAX_CHUNK_CHARS) -> List[str]:
+    """Split extracted PDF text on page boundaries into chunks of at most ~max_chars.
+
+    Never returns more chunks than questions, so every chunk gets at least one question.
+    """
+    pages = [p for p in re.split(r'(?=={5} PAGE \d+ START ={5})', text) if p.strip()]
+    if not pages:
+        return [text]
+
+    chunks: List[str] = []
+    current = ""
+    for page in pages:
+        if current and len(current) + len(page) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += page
+    if current:
+        chunks.append(current)
+
+    # Merge neighbours until there are no more chunks than questions
+    while len(chunks) > max(1, num_questions):
+        i = min(range(len(chunks) - 1), key=lambda k: len(chunks[k]) + len(chunks[k + 1]))
+        chunks[i:i + 2] = [chunks[i] + chunks[i + 1]]
+    return chunks
+
+
+def allocate_questions(num_questions: int, num_chunks: int) -> List[int]:
+    """Spread num_questions as evenly as possible over num_chunks."""
+    base, extra = divmod(num_questions, num_chunks)
+    return [base + (1 if i < extra else 0) for i in range(num_chunks)]
+
+
+def merge_mcq_payloads(payloads: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine per-chunk payloads into one document with sequential question ids."""
+    if len(payloads) == 1:
+        return payloads[0]
+
+    good = [p for p in payloads if isinstance(p.get("questions"), list)]
+    if not good:
+        return payloads[0]
+    if len(good) < len(payloads):
+        logging.warning(f"{len(payloads) - len(good)} of {len(payloads)} chunk responses were unusable; continuing with the rest")
+
+    questions: List[Dict[str, Any]] = []
+    for p in good:
+        questions.extend(p["questions"])
+    for i, q in enumerate(questions, start=1):
+        if isinstance(q, dict):
+            q["id"] = f"Q{i}"
+
+    summary = " ".join((p.get("source_summary") or "").strip() for p in good).strip()
+    return {"source_summary": summary[:400], "questions": questions}
+
+
+async def call_openai_generate_diagnostic_async(client, model, messages, response_format=None):
+    """Call OpenAI Chat Completions with diagnostics (log_event) and error handling."""
+    log_event("openai.call.start", model=model, key_present=bool(os.getenv("OPENAI_API_KEY")))
+    try:
+        extra = {"response_format": response_format} if response_format else {}
+        resp = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=0,
+            timeout=120,  # keep under Cloud Run timeout
+            **extra,
+        )
+        # cached_tokens > 0 means the fixed system prompt hit OpenAI's prompt cache
+        usage = getattr(resp, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        log_event(
+            "openai.call.ok",
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            cached_tokens=getattr(details, "cached_tokens", None),
+        )
+        return resp
+    except Exception as e:
+        log_event("openai.call.error", type=type(e).__name__, msg=str(e))
+        traceback.print_exc()
+        raise
+
+
+async def generate_mcqs_to_file_async(
+    pdf_path: str | None,
+    output_dir: str,
+    model: str,
+    num_questions: int,
+    language: str = 'en',
+    max_concurrency: int = OPENAI_MAX_CONCURRENCY,
+    batch_size: int = MCQ_BATCH_SIZE,
+    pdf_bytes: bytes | None = None,
+    text: str | None = None,
+) -> Tuple[str, Dict[str, Any], bool]:
+    """Generate MCQs from a PDF and write one combined JSON. Returns (JSON path, payload, complete).
+
+    The PDF is read from pdf_bytes when given (e.g. an upload held in memory),
+    otherwise from pdf_path. Callers that already extracted the text (see
+    extract_text_from_pdf) pass it as text to skip extraction.
+
+    The payload holds at most num_questions questions, so callers never re-read
+    or re-write the file. Large documents are split on page boundaries; up to batch_size chunks share
+    one completion (one copy of the instructions), and the completions run
+    concurrently (bounded by max_concurrency to respect rate limits).
+
+    complete is False when a chunk's response was unusable or fewer than
+    num_questions questions came back; such a payload should not be cached.
+    """
     # Normalize inputs
     lang = normalize_language(language)
     num_questions = clamp_num_questions(num_questions)
-    
+
     logging.info(f"Generating MCQs (library mode)… Language: {lang}, Questions: {num_questions}")
-    
+
     # Ensure output_dir is in /tmp for Cloud Run
     if not output_dir.startswith('/tmp'):
         output_dir = os.path.join('/tmp', os.path.basename(output_dir))
         os.makedirs(output_dir, exist_ok=True)
-    
-    text = extract_text_from_pdf(pdf_path)
-    
-    # Use the existing build_user_prompt function for now
-    user_prompt = build_user_prompt(text, num_questions, lang)
-    messages = [{"role": "user", "content": user_prompt}]
-    
+
+    if text is None:
+        text = await asyncio.to_thread(extract_text_from_pdf, pdf_path, pdf_bytes)
+
     # Check OpenAI key
     if not os.getenv("OPENAI_API_KEY"):
         raise RuntimeError("OPENAI_API_KEY is not set at runtime.")
-    
-    client = init_openai_client()
-    resp = call_openai_generate_diagnostic(client, model, messages)
-    
-    # Extract content from response
-    if hasattr(resp, 'choices') and resp.choices:
-        text_content = resp.choices[0].message.content
-        logging.info(f"Raw OpenAI response length: {len(text_content)}")
-        logging.info(f"Raw response preview: {text_content[:200]}...")
-        
-        try:
-            payload = json.loads(text_content)
-            logging.info(f"✅ Successfully parsed JSON with {len(payload.get('questions', []))} questions")
-        except json.JSONDecodeError as e:
-            logging.error(f"❌ JSON parsing failed: {e}")
-            logging.error(f"📄 Raw OpenAI response (first 500 chars):")
-            logging.error(f"{text_content[:500]}")
-            logging.error(f"📄 Raw OpenAI response (last 500 chars):")
-            logging.error(f"{text_content[-500:]}")
-            
-            # Try to extract JSON from the response if it's wrapped in markdown
-            import re
-            json_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', text_content, re.DOTALL)
-            if json_match:
-                logging.info(f"🔍 Found JSON in markdown, attempting extraction...")
-                try:
-                    payload = json.loads(json_match.group(1))
-                    logging.info(f"✅ Successfully extracted JSON from markdown with {len(payload.get('questions', []))} questions")
-                except json.JSONDecodeError as e2:
-                    logging.error(f"❌ Failed to parse extracted JSON: {e2}")
-                    logging.error(f"📄 Extracted JSON: {json_match.group(1)[:200]}...")
-                    payload = {"_raw_text": text_content, "_error": "json_decode_failed", "_exception": str(e2)}
-            else:
-                logging.error(f"❌ No JSON found in markdown format")
-                # Try to find the first { and last } to extract JSON
-                first_brace = text_content.find('{')
-                last_brace = text_content.rfind('}')
-                if first_brace != -1 and last_brace != -1 and last_brace > first_brace:
-                    potential_json = text_content[first_brace:last_brace+1]
-                    logging.info(f"🔍 Attempting to extract JSON from position {first_brace} to {last_brace}")
-                    try:
-                        payload = json.loads(potential_json)
-                        logging.info(f"✅ Successfully extracted JSON from position with {len(payload.get('questions', []))} questions")
-                    except json.JSONDecodeError as e3:
-                        logging.error(f"❌ Failed to parse position-extracted JSON: {e3}")
-                        payload = {"_raw_text": text_content, "_error": "json_decode_failed", "_exception": str(e3)}
-                else:
-                    payload = {"_raw_text": text_content, "_error": "json_decode_failed", "_exception": str(e)}
-    else:
-        raise RuntimeError("No valid response from OpenAI")
+
+    chunks = split_text_into_chunks(text, num_questions)
+    counts = allocate_questions(num_questions, len(chunks))
+    logging.info(f"Split text into {len(chunks)} chunk(s); questions per chunk: {counts}")
+
+    semaphore = asyncio.Semaphore(max_concurrency)
+    client = init_async_openai_client()
+
+    async def generate_batch(batch: List[int]) -> List[Dict[str, Any]]:
+        if len(batch) == 1:
+            i = batch[0]
+            messages = build_mcq_messages(build_user_prompt(chunks[i], counts[i], lang))
+            response_format = None
+        else:
+            prompt = build_batch_user_prompt([chunks[i] for i in batch], [counts[i] for i in batch], lang)
+            messages = build_mcq_messages(prompt)
+            response_format = {"type": "json_object"}
+        async with semaphore:
+            resp = await call_openai_generate_diagnostic_async(client, model, messages, response_format)
+        if not (hasattr(resp, 'choices') and resp.choices):
+            raise RuntimeError("No valid response from OpenAI")
+        payload = parse_mcq_json(resp.choices[0].message.content)
+        return [payload] if len(batch) == 1 else split_batch_payload(payload, len(batch))
+
+    batches = [list(range(i, min(i + max(1, batch_size), len(chunks)))) for i in range(0, len(chunks), max(1, batch_size))]
+    logging.info(f"Sending {len(batches)} completion(s) for {len(chunks)} chunk(s)")
+
+    try:
+        results = await asyncio.gather(*[generate_batch(b) for b in batches])
+    finally:
+        await client.close()
+    chunk_payloads = [p for batch_payloads in results for p in batch_payloads]
+    payload = merge_mcq_payloads(chunk_payloads)
+    questions = payload.get("questions")
+    payload["questions"] = questions[:num_questions] if isinstance(questions, list) else []
+    if not payload["questions"]:
+        raise ValueError("No questions generated from PDF")
+    complete = (
+        len(payload["questions"]) == num_questions
+        and all(isinstance(p.get("questions"), list) for p in chunk_payloads)
+    )
+    if not complete:
+        logging.warning(f"Generated {len(payload['questions'])} of {num_questions} questions")
 
     written_paths = save_outputs(payload, output_dir)
     combined_path = written_paths[0]
     logging.info(f"MCQs JSON written to: {combined_path}")
-    return combined_path
+    return combined_path, payload, complete
+
+
+def generate_mcqs_to_file(pdf_path: str, output_dir: str, model: str, num_questions: int, language: str = 'en') -> Tuple[str, Dict[str, Any]]:
+    """Generate MCQs from a PDF and write one combined JSON. Returns (JSON path, payload)."""
+    combined_path, payload, _ = asyncio.run(generate_mcqs_to_file_async(pdf_path, output_dir, model, num_questions, language))
+    return combined_path, payload
 
 def save_outputs(payload: Dict[str, Any], output_dir: str) -> List[str]:
     os.makedirs(output_dir, exist_ok=True)
@@ -353,13 +690,9 @@ def save_outputs(payload: Dict[str, Any], output_dir: str) -> List[str]:
     combined_path = os.path.join(output_dir, "mcqs.json")
     logging.info(f"Writing combined JSON: {combined_path}")
     
-    # Remove existing file if it exists (override behavior)
-    if os.path.exists(combined_path):
-        logging.info(f"Overwriting existing file: {combined_path}")
-        os.remove(combined_path)
-    
-    with open(combined_path, "w", encoding="utf-8") as f:
-        json.dump(payload, f, ensure_ascii=False, indent=2)
+    # "wb" truncates an existing file, so a previous run's output is simply overwritten
+    with open(combined_path, "wb") as f:
+        f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
 
     return [combined_path]
 
@@ -400,7 +733,7 @@ def main():
     )
 
     try:
-        combined_path = generate_mcqs_to_file(pdf_path, output_dir, model, num_questions)
+        combined_path, _ = generate_mcqs_to_file(pdf_path, output_dir, model, num_questions)
         logging.info("All files written:")
         logging.info(f" - {combined_path}")
 
@@ -15,7 +15,7 @@ from pathlib import Path
 def check_requirements():
     """Check if all required packages are installed"""
     required_packages = [
-        'flask', 'pdfplumber', 'openai', 'googleapiclient', 
+        'flask', 'fitz', 'openai', 'googleapiclient', 
         'google_auth_oauthlib', 'dotenv'
     ]
     
@@ -8,8 +8,11 @@ Token utilities for Google OAuth authentication with Cloud Run secret mounting s
 import os
 import pathlib
 import pickle
+import tempfile
 from typing import Optional
 
+import orjson
+
 
 # Token paths for different environments
 TOKEN_DEFAULT = "token.pkl"          # for local dev
@@ -44,8 +47,66 @@ def load_google_token():
             f"Provide local {TOKEN_DEFAULT} or mount secret to {TOKEN_CLOUD}."
         )
     
+    creds, legacy = _read_token(path)
+    if legacy:
+        # One-time migration of a pickled token to JSON (the Cloud Run mount is read-only)
+        try:
+            save_google_token(creds, path)
+        except OSError:
+            pass
+    return creds
+
+
+def read_google_token(path: str):
+    """
+    Load Google OAuth credentials from a token file.
+
+    Tokens are stored as authorized-user JSON (Credentials.to_json()); older
+    pickled tokens are still read.
+
+    Args:
+        path (str): Path to the token file.
+
+    Returns:
+        Google OAuth credentials object
+    """
+    return _read_token(path)[0]
+
+
+def _read_token(path: str):
+    # Returns (credentials, was_pickled)
     with open(path, "rb") as f:
-        return pickle.load(f)
+        raw = f.read()
+    if raw.lstrip()[:1] == b"{":
+        from google.oauth2.credentials import Credentials
+        return Credentials.from_authorized_user_info(orjson.loads(raw)), False
+    return pickle.loads(raw), True
+
+
+def save_google_token(creds, path: Optional[str] = None) -> str:
+    """
+    Save Google OAuth credentials as JSON, atomically.
+
+    Args:
+        creds: Google OAuth credentials object
+        path (str): Destination; defaults to get_token_path()
+
+    Returns:
+        str: The path written
+    """
+    path = path or get_token_path()
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp_token_", dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(creds.to_json().encode("utf-8"))
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return path
 
 
 def get_client_secret_path() -> str: